@@ -15,6 +15,9 @@ Made available under GNU GENERAL PUBLIC LICENSE
 
 """
 
+import os
+
+# Defaults for lcd(); pass address/port to drive other panels
 # i2c bus (0 -- original Pi, 1 -- Rev 2 Pi)
 
 I2CBUS = 1
@@ -22,28 +25,182 @@ I2CBUS = 1
 # LCD Address
 ADDRESS = 0x3f
 
-import smbus
-from time import sleep
+# LCD geometry (columns x rows)
+LCD_COLS = 16
+LCD_ROWS = 2
+
+# DDRAM address of the first cell of each line
+LCD_LINE_OFFSETS = [0x00, 0x40, 0x14, 0x54]
+
+# Characters of DDRAM behind each line of a 2-line display; the display
+# shift command scrolls the visible window around this ring
+LCD_DDRAM_LINE = 40
+
+# Send each string as one precomputed PCF8574 byte sequence instead of
+# one write_byte call (plus fixed sleeps) per nibble edge
+BATCHED_WRITES = True
+
+# Largest payload smbus accepts in a single i2c block write (command + 32)
+I2C_BLOCK_MAX = 32
+
+# HD44780 execution times from the datasheet (seconds)
+LCD_EXEC_DELAY = 0.000037
+LCD_CLEAR_DELAY = 0.00152
+
+# Reopen attempts after a failed transfer, and the backoff between them
+# (doubling from RECONNECT_DELAY up to RECONNECT_MAX_DELAY seconds)
+RECONNECT_ATTEMPTS = 8
+RECONNECT_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5.0
+
+# Shadow cell whose content on the glass is unknown; never equal to a
+# framebuffer cell, so the next flush rewrites it
+UNKNOWN_CELL = u'\uffff'
+
+# Transport behind i2c_device: "smbus" for the real bus, "emulator" for the
+# in-memory HD44780 emulator in lcd_emulator.py (runs off the Pi)
+TRANSPORT = os.getenv('LCD_TRANSPORT', 'smbus')
+
+# smbus2 adds i2c_rdwr, which can push a whole sequence in one kernel call;
+# neither is required when running on the emulator
+try:
+   import smbus2 as smbus
+   from smbus2 import i2c_msg
+except ImportError:
+   try:
+      import smbus
+   except ImportError:
+      smbus = None
+   i2c_msg = None
+from time import sleep, perf_counter
+
+import lcd_glyphs
+
+# Open the bus object selected by TRANSPORT; shared=True for a bus that
+# several panels (addresses) will be written through
+def open_transport(port=I2CBUS, shared=False):
+   if TRANSPORT == 'emulator':
+      import lcd_emulator
+      return lcd_emulator.EmulatedBus() if shared else lcd_emulator.LCDEmulator()
+   if smbus is None:
+      raise ImportError("smbus/smbus2 is not installed; set LCD_TRANSPORT=emulator to run without hardware")
+   return smbus.SMBus(port)
 
 class i2c_device:
-   def __init__(self, addr, port=I2CBUS):
+   def __init__(self, addr, port=I2CBUS, transport=None):
       self.addr = addr
-      self.bus = smbus.SMBus(port)
+      self.port = port
+      # a bus passed in may be shared with other devices, so it is probed
+      # again after an error rather than reopened
+      self.owns_bus = transport is None
+      self.bus = transport if transport is not None else open_transport(port)
+
+      # called after the bus has been reopened, e.g. to resync the lcd
+      self.on_reconnect = None
+      self.reconnecting = False
+
+      # transfer statistics, see bytes_per_second()
+      self.bytes_written = 0
+      self.transactions = 0
+      self.busy_time = 0.0
+      self.errors = 0
+      self.reconnects = 0
 
 # Write a single command
    def write_cmd(self, cmd):
-      self.bus.write_byte(self.addr, cmd)
-      sleep(0.0001)
+      start = perf_counter()
+      try:
+         self.bus.write_byte(self.addr, cmd)
+      except OSError as e:
+         self.reconnect(e)
+         return
+      self.delay(0.0001)
+      self.bytes_written += 1
+      self.transactions += 1
+      self.busy_time += perf_counter() - start
+
+# Write a sequence of raw bytes with as few kernel calls as possible
+   def write_bytes(self, data):
+      if not data:
+         return
+      try:
+         self.send_bytes(data)
+      except OSError as e:
+         self.reconnect(e)
+
+   def send_bytes(self, data):
+      start = perf_counter()
+      if i2c_msg is not None and hasattr(self.bus, 'i2c_rdwr'):
+         self.bus.i2c_rdwr(i2c_msg.write(self.addr, data))
+         self.transactions += 1
+      else:
+         # PCF8574 latches every byte it receives, so the "command" byte of
+         # a block write is just the first byte of the sequence
+         for i in range(0, len(data), I2C_BLOCK_MAX + 1):
+            chunk = data[i:i + I2C_BLOCK_MAX + 1]
+            if len(chunk) == 1:
+               self.bus.write_byte(self.addr, chunk[0])
+            else:
+               self.bus.write_i2c_block_data(self.addr, chunk[0], list(chunk[1:]))
+            self.transactions += 1
+      self.bytes_written += len(data)
+      self.busy_time += perf_counter() - start
+
+# A NACK from the PCF8574 (loose wire, brown-out) surfaces as OSError: reopen
+# the bus with exponential backoff until the device answers, then call
+# on_reconnect. The write that failed is dropped, since the lcd rewrites
+# every cell after it resyncs. Raises the last error if the device stays away.
+   def reconnect(self, error):
+      self.errors += 1
+      if self.reconnecting:
+         raise error
+      self.reconnecting = True
+      try:
+         delay = RECONNECT_DELAY
+         for attempt in range(RECONNECT_ATTEMPTS):
+            sleep(delay)
+            try:
+               if self.owns_bus:
+                  close = getattr(self.bus, 'close', None)
+                  if close is not None:
+                     close()
+                  self.bus = open_transport(self.port)
+               self.bus.read_byte(self.addr)
+               break
+            except OSError as e:
+               error = e
+               delay = min(delay * 2, RECONNECT_MAX_DELAY)
+         else:
+            raise error
+         self.reconnects += 1
+         if self.on_reconnect is not None:
+            self.on_reconnect()
+      finally:
+         self.reconnecting = False
+
+# Wait for the device; transports that emulate time (lcd_emulator) account
+# the delay instead of sleeping
+   def delay(self, seconds):
+      if hasattr(self.bus, 'sleep'):
+         self.bus.sleep(seconds)
+      else:
+         sleep(seconds)
+
+# Measured throughput of everything written so far
+   def bytes_per_second(self):
+      if self.busy_time == 0:
+         return 0.0
+      return self.bytes_written / self.busy_time
 
 # Write a command and argument
    def write_cmd_arg(self, cmd, data):
       self.bus.write_byte_data(self.addr, cmd, data)
-      sleep(0.0001)
+      self.delay(0.0001)
 
 # Write a block of data
    def write_block_data(self, cmd, data):
       self.bus.write_block_data(self.addr, cmd, data)
-      sleep(0.0001)
+      self.delay(0.0001)
 
 # Read a single byte
    def read(self):
@@ -105,33 +262,100 @@ Rw = 0b00000010 # Read/Write bit
 Rs = 0b00000001 # Register select bit
 
 class lcd:
-   #initializes objects and lcd
-   def __init__(self):
-      self.lcd_device = i2c_device(ADDRESS)
-
+   #initializes objects and lcd; device replaces the i2c_device, e.g. with a
+   #queue onto a bus shared with other panels (see display_manager.py)
+   #warm=True is for a restarted process driving an lcd that kept its
+   #contents: the glass is not cleared, and every cell is rewritten on the
+   #first flush instead
+   def __init__(self, transport=None, address=ADDRESS, port=I2CBUS, device=None, warm=False):
+      self.address = address
+      self.port = port
+      self.lcd_device = device if device is not None else i2c_device(address, port, transport)
+
+      # backlight pin state sent with every write, so backlight(0) sticks
+      self.backlight_mask = LCD_BACKLIGHT
+      self.display_on = True
+
+      self.lcd_init_sequence(clear=not warm)
+      self.lcd_device.delay(LCD_CLEAR_DELAY if warm else 0.2)
+
+      # CGRAM slots for symbols the character ROM lacks (see lcd_glyphs.py)
+      self.glyphs = lcd_glyphs.GlyphCache(self)
+
+      # characters the display window is shifted left by (see lcd_marquee_step)
+      self.marquee_offset = 0
+
+      # shadow of what is on the glass, and the pending frame to be flushed
+      fill = UNKNOWN_CELL if warm else ' '
+      self.shadow = [[fill] * LCD_COLS for _ in range(LCD_ROWS)]
+      self.framebuffer = [[' '] * LCD_COLS for _ in range(LCD_ROWS)]
+
+      # after the bus comes back the controller may be out of step; the
+      # device may be written from another thread (display_manager.py), so
+      # the resync is left to the next flush
+      self.resync_pending = False
+      if hasattr(self.lcd_device, 'on_reconnect'):
+         self.lcd_device.on_reconnect = self.request_resync
+
+   # put the controller into 4-bit mode and set it up; clear=False keeps
+   # DDRAM (what is on the glass) and only undoes any display shift
+   def lcd_init_sequence(self, clear=True):
       self.lcd_write(0x03)
       self.lcd_write(0x03)
       self.lcd_write(0x03)
       self.lcd_write(0x02)
 
       self.lcd_write(LCD_FUNCTIONSET | LCD_2LINE | LCD_5x8DOTS | LCD_4BITMODE)
-      self.lcd_write(LCD_DISPLAYCONTROL | LCD_DISPLAYON)
-      self.lcd_write(LCD_CLEARDISPLAY)
+      self.lcd_write(LCD_DISPLAYCONTROL | (LCD_DISPLAYON if self.display_on else LCD_DISPLAYOFF))
+      self.lcd_write(LCD_CLEARDISPLAY if clear else LCD_RETURNHOME)
       self.lcd_write(LCD_ENTRYMODESET | LCD_ENTRYLEFT)
-      sleep(0.2)
+
+   # resync after the bus dropped out: the controller may have latched half
+   # a byte, so it is put back into 4-bit mode and the next flush rewrites
+   # every cell. A brown-out also wipes CGRAM, so the glyphs the pending
+   # frame uses are uploaded again and the others are forgotten.
+   def lcd_resync(self):
+      self.lcd_init_sequence(clear=False)
+      self.lcd_device.delay(LCD_CLEAR_DELAY)
+      self.glyphs.invalidate(self.slots_in_use())
+      self.marquee_offset = 0
+      for row in self.shadow:
+         row[:] = [UNKNOWN_CELL] * LCD_COLS
+
+   def request_resync(self):
+      self.resync_pending = True
 
 
    # clocks EN to latch command
    def lcd_strobe(self, data):
-      self.lcd_device.write_cmd(data | En | LCD_BACKLIGHT)
-      sleep(.0005)
-      self.lcd_device.write_cmd(((data & ~En) | LCD_BACKLIGHT))
-      sleep(.0001)
+      self.lcd_device.write_cmd(data | En | self.backlight_mask)
+      self.lcd_device.delay(.0005)
+      self.lcd_device.write_cmd(((data & ~En) | self.backlight_mask))
+      self.lcd_device.delay(.0001)
 
    def lcd_write_four_bits(self, data):
-      self.lcd_device.write_cmd(data | LCD_BACKLIGHT)
+      self.lcd_device.write_cmd(data | self.backlight_mask)
       self.lcd_strobe(data)
 
+   # PCF8574 byte sequence that clocks one nibble into the lcd
+   def nibble_bytes(self, data):
+      mask = self.backlight_mask
+      return [data | mask, data | En | mask, (data & ~En) | mask]
+
+   # PCF8574 byte sequence for a full command (mode=0) or character (mode=Rs);
+   # at 100 kHz each byte takes ~90 us on the wire, which already covers the
+   # enable pulse width and the 37 us execution time of the previous write
+   def encode(self, value, mode=0):
+      return (self.nibble_bytes(mode | (value & 0xF0)) +
+              self.nibble_bytes(mode | ((value << 4) & 0xF0)))
+
+   # PCF8574 byte sequence that sets the DDRAM address and writes a string
+   def encode_string(self, string, addr):
+      data = self.encode(LCD_SETDDRAMADDR | addr)
+      for char in string:
+         data += self.encode(ord(char), Rs)
+      return data
+
    # write a command to lcd
    def lcd_write(self, cmd, mode=0):
       self.lcd_write_four_bits(mode | (cmd & 0xF0))
@@ -154,26 +378,157 @@ class lcd:
     elif line == 4:
       pos_new = 0x54 + pos
 
-    self.lcd_write(0x80 + pos_new)
+    # symbols like degree or arrows go through the CGRAM glyph cache
+    string = self.glyphs.map_string(string)
+
+    if BATCHED_WRITES:
+      self.lcd_device.write_bytes(self.encode_string(string, pos_new))
+    else:
+      self.lcd_write(0x80 + pos_new)
+
+      for char in string:
+        self.lcd_write(ord(char), Rs)
 
-    for char in string:
-      self.lcd_write(ord(char), Rs)
+    # keep the shadow and the pending frame in step with the glass
+    if line <= LCD_ROWS:
+      for i, char in enumerate(string[:max(LCD_COLS - pos, 0)]):
+        self.shadow[line - 1][pos + i] = char
+        self.framebuffer[line - 1][pos + i] = char
 
    # clear lcd and set to home
    def lcd_clear(self):
-      self.lcd_write(LCD_CLEARDISPLAY)
-      self.lcd_write(LCD_RETURNHOME)
+      if BATCHED_WRITES:
+         self.lcd_device.write_bytes(self.encode(LCD_CLEARDISPLAY))
+         self.lcd_device.delay(LCD_CLEAR_DELAY)
+         self.lcd_device.write_bytes(self.encode(LCD_RETURNHOME))
+         self.lcd_device.delay(LCD_CLEAR_DELAY)
+      else:
+         self.lcd_write(LCD_CLEARDISPLAY)
+         self.lcd_write(LCD_RETURNHOME)
+      self.marquee_offset = 0
+      for row in self.shadow + self.framebuffer:
+         row[:] = [' '] * LCD_COLS
+
+   # load text into the whole 40-character DDRAM line for hardware scrolling;
+   # both lines scroll together, so only use this when no line must stay put
+   def lcd_marquee_load(self, text, line=1):
+      self.lcd_display_string(text[:LCD_DDRAM_LINE].ljust(LCD_DDRAM_LINE), line)
+
+   # scroll the display window one character with a single command byte
+   def lcd_marquee_step(self, direction=LCD_MOVELEFT):
+      command = LCD_CURSORSHIFT | LCD_DISPLAYMOVE | direction
+      if BATCHED_WRITES:
+         self.lcd_device.write_bytes(self.encode(command))
+      else:
+         self.lcd_write(command)
+      step = -1 if direction == LCD_MOVERIGHT else 1
+      self.marquee_offset = (self.marquee_offset + step) % LCD_DDRAM_LINE
+
+   # undo any hardware scrolling so the shadow matches the glass again
+   def lcd_marquee_reset(self):
+      if self.marquee_offset == 0:
+         return
+      if BATCHED_WRITES:
+         self.lcd_device.write_bytes(self.encode(LCD_RETURNHOME))
+      else:
+         self.lcd_write(LCD_RETURNHOME)
+      self.lcd_device.delay(LCD_CLEAR_DELAY)
+      self.marquee_offset = 0
+
+   # blank the pending frame without touching the glass
+   def lcd_buffer_clear(self):
+      for row in self.framebuffer:
+         row[:] = [' '] * LCD_COLS
+
+   # put string into the pending frame; nothing is sent until lcd_flush()
+   def lcd_buffer_string(self, string, line=1, pos=0):
+      string = self.glyphs.map_string(string)
+      row = self.framebuffer[line - 1]
+      for i, char in enumerate(string[:max(LCD_COLS - pos, 0)]):
+         row[pos + i] = char
+
+   # send only the cells that differ from the glass, one DDRAM address
+   # set per run of dirty cells; returns the number of cells written
+   def lcd_flush(self):
+      if self.resync_pending:
+         self.resync_pending = False
+         self.lcd_resync()
+      written = 0
+      data = []
+      for line in range(LCD_ROWS):
+         for start, end in self.dirty_runs(line):
+            run = ''.join(self.framebuffer[line][start:end])
+            if BATCHED_WRITES:
+               data += self.encode_string(run, LCD_LINE_OFFSETS[line] + start)
+            else:
+               self.lcd_write(LCD_SETDDRAMADDR | (LCD_LINE_OFFSETS[line] + start))
+               for char in run:
+                  self.lcd_write(ord(char), Rs)
+            self.shadow[line][start:end] = list(run)
+            written += end - start
+      # the whole frame goes out as a single batched transfer
+      self.lcd_device.write_bytes(data)
+      return written
+
+   # runs of changed cells on a line as (start, end) column pairs; a clean
+   # gap of a single cell is cheaper to rewrite than to skip with an address set
+   def dirty_runs(self, line):
+      runs = []
+      shadow = self.shadow[line]
+      frame = self.framebuffer[line]
+      for col in range(LCD_COLS):
+         if frame[col] == shadow[col]:
+            continue
+         if runs and col - runs[-1][1] <= 1:
+            runs[-1][1] = col + 1
+         else:
+            runs.append([col, col + 1])
+      return runs
 
    # define backlight on/off (lcd.backlight(1); off= lcd.backlight(0)
+   # the state is kept in backlight_mask, which every later write carries
    def backlight(self, state): # for state, 1 = on, 0 = off
       if state == 1:
-         self.lcd_device.write_cmd(LCD_BACKLIGHT)
+         self.backlight_mask = LCD_BACKLIGHT
       elif state == 0:
-         self.lcd_device.write_cmd(LCD_NOBACKLIGHT)
+         self.backlight_mask = LCD_NOBACKLIGHT
+      else:
+         return
+      self.lcd_device.write_cmd(self.backlight_mask)
+
+   # turn the display on or off; DDRAM (and the shadow) are kept while off
+   def lcd_display_power(self, on):
+      command = LCD_DISPLAYCONTROL | (LCD_DISPLAYON if on else LCD_DISPLAYOFF)
+      if BATCHED_WRITES:
+         self.lcd_device.write_bytes(self.encode(command))
+      else:
+         self.lcd_write(command)
+      self.display_on = on
 
    # add custom characters (0 - 7)
    def lcd_load_custom_chars(self, fontdata):
       self.lcd_write(0x40);
       for char in fontdata:
          for line in char:
-            self.lcd_write_char(line)         
+            self.lcd_write_char(line)
+      self.glyphs.reserve(range(len(fontdata)))
+
+   # load one custom character into CGRAM slot (0 - 7)
+   def lcd_load_glyph(self, slot, bitmap):
+      if BATCHED_WRITES:
+         data = self.encode(LCD_SETCGRAMADDR | (slot << 3))
+         for line in bitmap:
+            data += self.encode(line, Rs)
+         self.lcd_device.write_bytes(data)
+      else:
+         self.lcd_write(LCD_SETCGRAMADDR | (slot << 3))
+         for line in bitmap:
+            self.lcd_write_char(line)
+
+   # custom character slots that will be on the glass after the next flush:
+   # those in the pending frame. A shadow cell the frame doesn't overwrite
+   # already equals the frame's cell, and one it does overwrite is gone
+   # after the flush, so the outgoing frame doesn't hold on to its slots.
+   def slots_in_use(self):
+      return set(ord(char) for row in self.framebuffer
+                 for char in row if ord(char) < lcd_glyphs.CGRAM_SLOTS)         
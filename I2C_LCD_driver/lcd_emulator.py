@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory stand-in for an smbus bus with a PCF8574 backpack and an HD44780
+16x2 LCD behind it.
+
+It accepts the same calls I2C_LCD_driver.i2c_device makes on a real bus,
+decodes the 4-bit protocol into DDRAM/CGRAM state, and counts bus bytes,
+transactions and the time the driver spent waiting. Nothing sleeps unless
+realtime=True, so rendering can be timed on any Linux box:
+
+   import lcd_emulator, I2C_LCD_driver
+   bus = lcd_emulator.LCDEmulator()
+   screen = I2C_LCD_driver.lcd(transport=bus)
+   screen.lcd_display_string("Hello", 1)
+   print(bus.lines())
+"""
+
+from time import sleep as real_sleep
+
+# PCF8574 pin mapping used by I2C_LCD_driver
+En = 0b00000100
+Rs = 0b00000001
+BACKLIGHT = 0b00001000
+
+# Each DDRAM line is 40 characters long; line 2 starts at 0x40
+DDRAM_LINE_LENGTH = 40
+DDRAM_LINE_STARTS = [0x00, 0x40]
+
+# Standard I2C clock on the Pi, used to model time on the wire
+BUS_HZ = 100000
+
+class LCDEmulator:
+   def __init__(self, cols=16, rows=2, realtime=False):
+      self.cols = cols
+      self.rows = rows
+      self.realtime = realtime
+
+      self.ddram = [0x20] * 0x80
+      self.cgram = [0] * 64
+      self.address = 0
+      self.cgram_address = 0
+      self.in_cgram = False
+      self.increment = True
+      self.shift = 0
+      self.display_on = False
+      self.backlight_on = False
+
+      # the controller powers up in 8-bit mode until told otherwise
+      self.four_bit = False
+      self.pending_nibble = None
+      self.pins = 0
+
+      self.reset_counters()
+
+   # zero the traffic and timing counters
+   def reset_counters(self):
+      self.bytes_written = 0
+      self.transactions = 0
+      self.sleep_time = 0.0
+      self.commands = 0
+      self.characters = 0
+
+   # seconds the traffic so far would take on the wire (9 clocks a byte)
+   def bus_time(self):
+      return self.bytes_written * 9.0 / BUS_HZ
+
+   # smbus interface
+
+   def write_byte(self, addr, value):
+      self.transactions += 1
+      self.latch(value)
+
+   def write_byte_data(self, addr, cmd, value):
+      self.transactions += 1
+      self.latch(cmd)
+      self.latch(value)
+
+   def write_i2c_block_data(self, addr, cmd, values):
+      self.transactions += 1
+      self.latch(cmd)
+      for value in values:
+         self.latch(value)
+
+   def write_block_data(self, addr, cmd, values):
+      self.write_i2c_block_data(addr, cmd, values)
+
+   def read_byte(self, addr):
+      return self.pins
+
+   def read_byte_data(self, addr, cmd):
+      return self.pins
+
+   def read_block_data(self, addr, cmd):
+      return []
+
+   def sleep(self, seconds):
+      self.sleep_time += seconds
+      if self.realtime:
+         real_sleep(seconds)
+
+   # PCF8574 / HD44780 decoding
+
+   # set the expander pins; the LCD samples D4-D7 on the falling edge of En
+   def latch(self, value):
+      value &= 0xFF
+      self.bytes_written += 1
+      self.backlight_on = bool(value & BACKLIGHT)
+      if self.pins & En and not value & En:
+         self.clock_nibble(self.pins >> 4, self.pins & Rs)
+      self.pins = value
+
+   def clock_nibble(self, nibble, rs):
+      if not self.four_bit:
+         # 8-bit mode: the low data lines are tied low on the backpack
+         self.execute(nibble << 4, rs)
+         return
+      if self.pending_nibble is None:
+         self.pending_nibble = nibble
+      else:
+         value = (self.pending_nibble << 4) | nibble
+         self.pending_nibble = None
+         self.execute(value, rs)
+
+   def execute(self, value, rs):
+      if rs:
+         self.characters += 1
+         self.write_data(value)
+         return
+      self.commands += 1
+      if value & 0x80:
+         self.in_cgram = False
+         self.address = value & 0x7F
+      elif value & 0x40:
+         self.in_cgram = True
+         self.cgram_address = value & 0x3F
+      elif value & 0x20:
+         # function set; DL (0x10) selects the interface width
+         if not value & 0x10:
+            if not self.four_bit:
+               self.pending_nibble = None
+            self.four_bit = True
+      elif value & 0x10:
+         if value & 0x08:
+            # display shift: moving left shows higher addresses
+            self.shift = (self.shift + (-1 if value & 0x04 else 1)) % DDRAM_LINE_LENGTH
+         else:
+            self.move_address(1 if value & 0x04 else -1)
+      elif value & 0x08:
+         self.display_on = bool(value & 0x04)
+      elif value & 0x04:
+         self.increment = bool(value & 0x02)
+      elif value & 0x02:
+         self.address = 0
+         self.shift = 0
+      elif value & 0x01:
+         self.ddram = [0x20] * 0x80
+         self.address = 0
+         self.shift = 0
+         self.increment = True
+
+   def write_data(self, value):
+      if self.in_cgram:
+         self.cgram[self.cgram_address] = value & 0x1F
+         self.cgram_address = (self.cgram_address + 1) & 0x3F
+      else:
+         self.ddram[self.address] = value
+         self.move_address(1 if self.increment else -1)
+
+   # advance the DDRAM address, wrapping from the end of line 1 to line 2
+   def move_address(self, step):
+      line = 1 if self.address >= 0x40 else 0
+      index = self.address - DDRAM_LINE_STARTS[line] + step
+      if index >= DDRAM_LINE_LENGTH:
+         line, index = (line + 1) % 2, 0
+      elif index < 0:
+         line, index = (line + 1) % 2, DDRAM_LINE_LENGTH - 1
+      self.address = DDRAM_LINE_STARTS[line] + index
+
+   # what is on the glass
+
+   # visible text of each row, custom characters as chr(0)..chr(7)
+   def lines(self):
+      offsets = [0x00, 0x40, 0x14, 0x54]
+      rows = []
+      for row in range(self.rows):
+         start = DDRAM_LINE_STARTS[row % 2]
+         first = offsets[row] - start
+         rows.append(''.join(
+            chr(self.ddram[start + (first + col + self.shift) % DDRAM_LINE_LENGTH])
+            for col in range(self.cols)))
+      return rows
+
+   # the 8 row bitmaps of a custom character slot
+   def glyph(self, slot):
+      return self.cgram[slot * 8:slot * 8 + 8]
+
+# An emulated bus with several backpacks on it: calls are routed to one
+# LCDEmulator per address, created the first time the address is written
+class EmulatedBus:
+   def __init__(self, cols=16, rows=2, realtime=False):
+      self.cols = cols
+      self.rows = rows
+      self.realtime = realtime
+      self.devices = {}
+
+   def device(self, addr):
+      if addr not in self.devices:
+         self.devices[addr] = LCDEmulator(self.cols, self.rows, self.realtime)
+      return self.devices[addr]
+
+   def write_byte(self, addr, value):
+      self.device(addr).write_byte(addr, value)
+
+   def write_byte_data(self, addr, cmd, value):
+      self.device(addr).write_byte_data(addr, cmd, value)
+
+   def write_i2c_block_data(self, addr, cmd, values):
+      self.device(addr).write_i2c_block_data(addr, cmd, values)
+
+   def write_block_data(self, addr, cmd, values):
+      self.device(addr).write_block_data(addr, cmd, values)
+
+   def read_byte(self, addr):
+      return self.device(addr).read_byte(addr)
+
+   def read_byte_data(self, addr, cmd):
+      return self.device(addr).read_byte_data(addr, cmd)
+
+   def read_block_data(self, addr, cmd):
+      return self.device(addr).read_block_data(addr, cmd)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+CGRAM glyph cache for I2C_LCD_driver.lcd
+
+The HD44780 has 8 programmable character slots (CGRAM). GlyphCache maps
+Unicode symbols that the character ROM lacks (degree sign, arrows, sparkline
+bars, weather icons) to those slots on demand. A glyph is uploaded only when
+it is not already resident; when all slots are taken the least recently used
+slot that the pending frame doesn't use is reused. If every slot is in use,
+an ASCII stand-in is shown instead.
+"""
+
+from collections import OrderedDict
+
+# 5x8 bitmaps, one row per byte (low 5 bits)
+GLYPHS = {
+   u'°': [0b01100, 0b10010, 0b10010, 0b01100, 0, 0, 0, 0],            # degree
+   u'↑': [0b00100, 0b01110, 0b10101, 0b00100, 0b00100, 0b00100, 0b00100, 0],  # up arrow
+   u'↓': [0b00100, 0b00100, 0b00100, 0b00100, 0b10101, 0b01110, 0b00100, 0],  # down arrow
+
+   # sparkline bars, 1/8 to 8/8 high
+   u'▁': [0, 0, 0, 0, 0, 0, 0, 0b11111],
+   u'▂': [0, 0, 0, 0, 0, 0, 0b11111, 0b11111],
+   u'▃': [0, 0, 0, 0, 0, 0b11111, 0b11111, 0b11111],
+   u'▄': [0, 0, 0, 0, 0b11111, 0b11111, 0b11111, 0b11111],
+   u'▅': [0, 0, 0, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111],
+   u'▆': [0, 0, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111],
+   u'▇': [0, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111],
+   u'█': [0b11111] * 8,
+
+   # weather icons
+   u'☀': [0b00100, 0b10101, 0b01110, 0b11111, 0b01110, 0b10101, 0b00100, 0],  # sun
+   u'☁': [0, 0b01100, 0b10010, 0b10001, 0b11111, 0, 0, 0],                    # cloud
+   u'☂': [0b01110, 0b11111, 0b11111, 0b00100, 0b00100, 0b10100, 0b01000, 0],  # umbrella (rain)
+   u'❄': [0b00100, 0b10101, 0b01110, 0b11111, 0b01110, 0b10101, 0b00100, 0],  # snow
+   u'⚡': [0b00010, 0b00100, 0b01000, 0b11110, 0b00100, 0b01000, 0b10000, 0],  # lightning
+}
+
+# shown when a glyph can't be given a slot
+FALLBACKS = {
+   u'°': chr(0xDF),   # degree sign in the A00 character ROM
+   u'↑': '^',
+   u'↓': 'v',
+   u'▁': '_',
+   u'▂': '_',
+   u'▃': '-',
+   u'▄': '-',
+   u'▅': '=',
+   u'▆': '=',
+   u'▇': '#',
+   u'█': '#',
+   u'☀': '*',
+   u'☁': '~',
+   u'☂': '/',
+   u'❄': '*',
+   u'⚡': '!',
+}
+
+CGRAM_SLOTS = 8
+
+class GlyphCache:
+   def __init__(self, lcd, glyphs=GLYPHS):
+      self.lcd = lcd
+      self.glyphs = glyphs
+      self.resident = OrderedDict()   # char -> slot, least recently used first
+      self.reserved = set()           # slots loaded directly with lcd_load_custom_chars
+      self.uploads = 0
+      self.hits = 0
+      self.misses = 0
+
+   # slots loaded outside the cache are left alone
+   def reserve(self, slots):
+      for slot in slots:
+         self.reserved.add(slot)
+         for char, resident_slot in list(self.resident.items()):
+            if resident_slot == slot:
+               del self.resident[char]
+
+   # CGRAM contents are no longer known (e.g. after a brown-out): glyphs in
+   # keep (slots the pending frame shows) are uploaded again, the rest are
+   # forgotten and uploaded when next needed
+   def invalidate(self, keep=()):
+      for char, slot in list(self.resident.items()):
+         if slot in keep:
+            self.lcd.lcd_load_glyph(slot, self.glyphs[char])
+            self.uploads += 1
+         else:
+            del self.resident[char]
+
+   # translate a string for the LCD: glyph characters become their slot code
+   def map_string(self, string):
+      if string.isascii():
+         return string
+      mapped = []
+      pinned = set()   # slots already used earlier in this string
+      for char in string:
+         if ord(char) < 0x80:
+            mapped.append(char)
+         elif char in self.glyphs:
+            slot = self.slot_for(char, pinned)
+            if slot is None:
+               mapped.append(FALLBACKS.get(char, '?'))
+            else:
+               pinned.add(slot)
+               mapped.append(chr(slot))
+         elif ord(char) <= 0xFF:
+            mapped.append(char)
+         else:
+            mapped.append(FALLBACKS.get(char, '?'))
+      return ''.join(mapped)
+
+   # CGRAM slot holding char, uploading it first if needed; slots in pinned
+   # are never reused for it
+   def slot_for(self, char, pinned=()):
+      slot = self.resident.get(char)
+      if slot is not None:
+         self.resident.move_to_end(char)
+         self.hits += 1
+         return slot
+
+      self.misses += 1
+      slot = self.free_slot(pinned)
+      if slot is None:
+         return None
+      self.lcd.lcd_load_glyph(slot, self.glyphs[char])
+      self.resident[char] = slot
+      self.uploads += 1
+      return slot
+
+   # an unused slot, or the least recently used one the pending frame
+   # doesn't use
+   def free_slot(self, pinned=()):
+      taken = set(self.resident.values()) | self.reserved
+      for slot in range(CGRAM_SLOTS):
+         if slot not in taken:
+            return slot
+      visible = self.lcd.slots_in_use() | set(pinned)
+      for char, slot in self.resident.items():
+         if slot not in visible:
+            del self.resident[char]
+            return slot
+      return None
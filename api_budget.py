@@ -0,0 +1,138 @@
+# Signally LCD / API call budgets
+#
+# Each stock provider has a daily quota, a time-of-day window and a token
+# bucket that spaces calls out (one token per interval, up to burst tokens).
+# The daily count resets whenever the date changes, not only if the loop
+# happens to run at 00:00, and the whole state is saved to disk after every
+# spend so a restart cannot reset the quota.
+import json
+import threading
+from datetime import datetime
+
+from atomic_file import write_json
+
+class Provider:
+    def __init__(self, name, daily_limit, interval, window_start, window_end, burst=1):
+        self.name = name
+        self.daily_limit = daily_limit
+        self.interval = interval
+        self.window_start = window_start
+        self.window_end = window_end
+        self.burst = burst
+
+        self.day = None
+        self.used = 0
+        self.tokens = float(burst)
+        self.updated = None
+
+    def in_window(self, now):
+        return self.window_start <= now.time() <= self.window_end
+
+    # Roll the daily count over and add the tokens earned since the last update
+    def refill(self, now):
+        if self.day != now.date():
+            self.day = now.date()
+            self.used = 0
+        if self.updated is not None:
+            elapsed = max((now - self.updated).total_seconds(), 0)
+            self.tokens = min(self.burst, self.tokens + elapsed / self.interval)
+        self.updated = now
+
+class ApiBudget:
+    def __init__(self, path, providers):
+        self.path = path
+        self.providers = {provider.name: provider for provider in providers}
+        self.lock = threading.Lock()
+
+    # Restore counts and tokens saved by a previous run
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error loading API budget: {e}")
+            return
+        with self.lock:
+            for name, state in data.items():
+                provider = self.providers.get(name)
+                if provider is None:
+                    continue
+                try:
+                    provider.day = datetime.fromisoformat(state['day']).date()
+                    provider.used = int(state['used'])
+                    provider.tokens = min(float(state['tokens']), provider.burst)
+                    provider.updated = datetime.fromisoformat(state['updated'])
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"Ignoring malformed API budget for {name}: {e}")
+
+    def save(self):
+        with self.lock:
+            data = {name: {'day': provider.day.isoformat() if provider.day else None,
+                           'used': provider.used,
+                           'tokens': provider.tokens,
+                           'updated': provider.updated.isoformat() if provider.updated else None}
+                    for name, provider in self.providers.items()}
+        try:
+            write_json(self.path, data)
+        except Exception as e:
+            print(f"Error saving API budget: {e}")
+
+    # First provider whose window is open and whose daily quota is not used up
+    def active_provider(self, now=None):
+        now = now or datetime.now()
+        with self.lock:
+            for provider in self.providers.values():
+                provider.refill(now)
+                if provider.in_window(now) and provider.used < provider.daily_limit:
+                    return provider.name
+        return None
+
+    # True if a call to provider may be made right now
+    def ready(self, name, now=None):
+        now = now or datetime.now()
+        with self.lock:
+            provider = self.providers[name]
+            provider.refill(now)
+            return (provider.in_window(now) and provider.used < provider.daily_limit
+                    and provider.tokens >= 1)
+
+    # Take one call from provider's budget; False if none is available
+    def spend(self, name, now=None):
+        now = now or datetime.now()
+        with self.lock:
+            provider = self.providers[name]
+            provider.refill(now)
+            if not (provider.in_window(now) and provider.used < provider.daily_limit and provider.tokens >= 1):
+                return False
+            provider.tokens -= 1
+            provider.used += 1
+        self.save()
+        return True
+
+    # Remaining budget per provider, for metrics
+    def remaining(self, now=None):
+        now = now or datetime.now()
+        with self.lock:
+            result = {}
+            for name, provider in self.providers.items():
+                provider.refill(now)
+                result[name] = {'remaining_today': provider.daily_limit - provider.used,
+                                'used_today': provider.used,
+                                'tokens': provider.tokens,
+                                'in_window': provider.in_window(now)}
+            return result
+
+# Pick up to count symbols to spend a call on: those fetched longest ago (or
+# never) first, skipping any fetched within min_age seconds, so every call
+# refreshes the quotes that are most out of date
+def pick_symbols(symbols, age, count, min_age=0):
+    ages = []
+    for symbol in symbols:
+        seconds = age(symbol)
+        seconds = float('inf') if seconds is None else seconds
+        if seconds >= min_age:
+            ages.append((seconds, symbol))
+    ages.sort(key=lambda item: item[0], reverse=True)
+    return [symbol for _, symbol in ages[:count]]
@@ -0,0 +1,147 @@
+# Signally LCD / shared HTTP client for the weather and stock APIs
+#
+# One pooled requests.Session per host keeps connections alive between calls,
+# so after the first request a fetch costs a single round trip instead of
+# DNS + TCP + TLS setup. Transient server errors are retried with backoff,
+# responses carrying ETag/Last-Modified are revalidated with conditional
+# requests, and call latency is recorded per host.
+#
+# requests is imported on first use: it is most of the app's import time, and
+# startup should not wait for it before the LCD shows anything.
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from urllib.parse import urlsplit
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# Fixed-bucket latency histogram for one host
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # Approximate quantile: upper bound of the bucket containing it
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+# Any failed call: connection problem, error status or a body that isn't JSON
+class ApiError(Exception):
+    pass
+
+class ApiClient:
+    def __init__(self, timeout=(3.05, 10), retries=2, backoff=0.5, pool_size=2):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.validators = {}
+        self.latency = {}
+        self.not_modified = 0
+
+    # Pooled keep-alive session for a host, created on first use
+    def session_for(self, host):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                              status_forcelist=(500, 502, 503, 504),
+                              allowed_methods=frozenset(['GET']),
+                              respect_retry_after_header=True)
+                adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=self.pool_size)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[host] = session
+                self.latency[host] = LatencyHistogram()
+            return session
+
+    # GET a JSON document; raises ApiError if the call fails.
+    # A 304 Not Modified answer returns the body cached from the last 200.
+    def get_json(self, url, headers=None, params=None, timeout=None):
+        import requests
+
+        host = urlsplit(url).netloc
+        session = self.session_for(host)
+        key = (url, tuple(sorted((params or {}).items())))
+        request_headers = dict(headers or {})
+
+        with self.lock:
+            cached = self.validators.get(key)
+        if cached:
+            if cached['etag']:
+                request_headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                request_headers['If-Modified-Since'] = cached['last_modified']
+
+        start = perf_counter()
+        try:
+            response = session.get(url, headers=request_headers, params=params,
+                                   timeout=timeout or self.timeout)
+        except requests.RequestException as e:
+            with self.lock:
+                self.latency[host].errors += 1
+            raise ApiError(str(e)) from e
+        with self.lock:
+            self.latency[host].observe(perf_counter() - start)
+
+        if response.status_code == 304 and cached:
+            with self.lock:
+                self.not_modified += 1
+            return cached['data']
+
+        try:
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise ApiError(str(e)) from e
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            with self.lock:
+                self.validators[key] = {'etag': etag, 'last_modified': last_modified, 'data': data}
+        return data
+
+    # Per-host call statistics
+    def stats(self):
+        with self.lock:
+            return {host: {'count': histogram.count,
+                           'errors': histogram.errors,
+                           'mean': histogram.mean(),
+                           'p50': histogram.quantile(0.5),
+                           'p95': histogram.quantile(0.95),
+                           'buckets': dict(zip(histogram.buckets, histogram.counts))}
+                    for host, histogram in self.latency.items()}
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
@@ -0,0 +1,24 @@
+# Signally LCD / atomic JSON files
+#
+# State files (quote cache, API budgets, weather, state snapshot, message
+# cache) are written to a temp file next to the target, synced to disk and
+# renamed over it, so a crash or power cut leaves the old file or the new
+# one, never a half-written one.
+import os
+import json
+import tempfile
+
+# Write data to path as JSON; errors are raised to the caller, and the temp
+# file is removed
+def write_json(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
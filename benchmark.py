@@ -0,0 +1,294 @@
+# Signally LCD rendering benchmarks
+#
+# Runs the display code from lcdtimedate.py against the in-memory LCD
+# emulator (I2C_LCD_driver/lcd_emulator.py) so driver changes can be
+# measured on any Linux box. Sleeps are virtual; network fetches are
+# replaced with canned strings.
+#
+#   python benchmark.py            # all benchmarks
+#   python benchmark.py tick cycle # selected benchmarks
+import sys
+import os
+import io
+import tempfile
+import contextlib
+import subprocess
+from time import perf_counter, time
+
+# Run on the emulator with placeholder settings before lcdtimedate loads
+os.environ['LCD_TRANSPORT'] = 'emulator'
+os.environ.setdefault('METRICS_PORT', '')
+os.environ.setdefault('CONTROL_PORT', '')
+os.environ.setdefault('WATCHDOG_TIMEOUT', '')
+os.environ.setdefault('QUIET_HOURS', '')
+for name in ('OPENWEATHERMAP_API_KEY', 'ALPHA_VANTAGE_API_KEY', 'RAPIDAPI_KEY', 'CITY_NAME'):
+    os.environ.setdefault(name, 'benchmark')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'I2C_LCD_driver'))
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+import lcdtimedate
+imported = time()
+from screens import Playlist
+from fetch_scheduler import FetchScheduler
+import I2C_LCD_driver
+import lcd_emulator
+import lcd_glyphs
+
+# Raised from the patched end of main() to stop after one cycle; not an
+# Exception, so the display loop's supervisor lets it through
+class CycleDone(BaseException):
+    pass
+
+# Waits for fetches still in flight when main() stops, so a background
+# weather refresh can't write after the scratch directory is gone
+class FinishingFetcher(FetchScheduler):
+    def stop(self):
+        self.pause()
+        self.executor.shutdown(wait=True)
+
+# Measurements for one benchmark run
+class Result:
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.wall = 0.0
+        self.bus = None
+
+    def report(self):
+        bus = self.bus
+        frames = max(self.frames, 1)
+        return (f"{self.name:<10} frames={self.frames:<4} "
+                f"wall={self.wall * 1000:9.2f} ms  "
+                f"per-frame={self.wall * 1e6 / frames:8.1f} us  "
+                f"i2c bytes={bus.bytes_written:<6} "
+                f"bytes/frame={bus.bytes_written / frames:7.1f}  "
+                f"transactions={bus.transactions:<5} "
+                f"driver sleep={bus.sleep_time * 1000:8.2f} ms  "
+                f"bus time={bus.bus_time() * 1000:8.2f} ms")
+
+# Function to create an emulated LCD and count its flushed frames
+def make_lcd(result):
+    bus = lcd_emulator.LCDEmulator()
+    lcd = I2C_LCD_driver.lcd(transport=bus)
+    bus.reset_counters()
+    result.bus = bus
+
+    flush = lcd.lcd_flush
+    def counting_flush():
+        result.frames += 1
+        return flush()
+    lcd.lcd_flush = counting_flush
+    return lcd
+
+# Context that makes lcdtimedate sleep on the emulator clock, keeps its
+# logs in a scratch directory and silences its console output
+@contextlib.contextmanager
+def patched(bus):
+    saved = {name: getattr(lcdtimedate, name) for name in ('sleep', 'LOG_DIR')}
+    state_files = [lcdtimedate.stock_cache, lcdtimedate.api_budget, lcdtimedate.weather_cache,
+                   lcdtimedate.state_snapshot]
+    saved_history = lcdtimedate.price_history
+    saved_paths = [state.path for state in state_files]
+    saved_message_cache = lcdtimedate.message_corpus.cache_path
+    with tempfile.TemporaryDirectory() as scratch:
+        lcdtimedate.sleep = bus.sleep
+
+        # the frame scheduler's clocks advance with the emulator's sleeps
+        scheduler = lcdtimedate.frame_scheduler
+        saved_clocks = (scheduler.sleep, scheduler.monotonic, scheduler.time)
+        start_wall = scheduler.time()
+        scheduler.sleep = bus.sleep
+        scheduler.monotonic = lambda: bus.sleep_time
+        scheduler.time = lambda: start_wall + bus.sleep_time
+        lcdtimedate.LOG_DIR = os.path.join(scratch, 'logs')
+        for state in state_files:
+            state.path = os.path.join(scratch, os.path.basename(state.path))
+        lcdtimedate.price_history = lcdtimedate.PriceHistory(os.path.join(scratch, 'price_history.bin'))
+        lcdtimedate.message_corpus.cache_path = os.path.join(scratch, 'message_cache.json')
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                lcdtimedate.load_data()
+                lcdtimedate.price_history.open()
+                yield
+        finally:
+            lcdtimedate.close_log_writer()
+            for name, value in saved.items():
+                setattr(lcdtimedate, name, value)
+            scheduler.sleep, scheduler.monotonic, scheduler.time = saved_clocks
+            for state, path in zip(state_files, saved_paths):
+                state.path = path
+            lcdtimedate.message_corpus.cache_path = saved_message_cache
+            lcdtimedate.price_history.close()
+            lcdtimedate.price_history = saved_history
+
+# Benchmark: the 30 ticks of the date screen
+def bench_tick():
+    result = Result('tick')
+    lcd = make_lcd(result)
+    with patched(result.bus):
+        start = perf_counter()
+        lcdtimedate.date_screen().show(lcd, lcdtimedate.frame_scheduler, lcdtimedate.log_to_file)
+        result.wall = perf_counter() - start
+    return result
+
+# Benchmark: the opening animation
+def bench_opening():
+    result = Result('opening')
+    lcd = make_lcd(result)
+    with patched(result.bus):
+        start = perf_counter()
+        lcdtimedate.display_opening_message(lcd)
+        result.wall = perf_counter() - start
+    return result
+
+# Benchmark: one full pass of main(), from initialization to the weather screen
+def bench_cycle():
+    result = Result('cycle')
+    lcd = make_lcd(result)
+
+    def stop_after_cycle():
+        raise CycleDone()
+
+    patches = {
+        'initialize_lcd': lambda *args, **kwargs: lcd,
+        'get_weather': lambda: lcdtimedate.weather_cache.put_observation(72, 'Clear') or True,
+        'get_weather_forecast': lambda: lcdtimedate.weather_cache.put_forecast(
+            [(time() + hours * 3600, 70 - hours, 'Clouds') for hours in (1, 4, 7)]) or True,
+        'get_stock_prices_alpha_vantage': lambda symbols: {symbol: lcdtimedate.store_quote(symbol, 178.35, 1.22) for symbol in symbols},
+        'get_stock_prices_rapidapi': lambda symbols: {symbol: lcdtimedate.store_quote(symbol, 178.35, 1.22) for symbol in symbols},
+        'Playlist': lambda entries, after_cycle=None, priority=None: Playlist(entries, stop_after_cycle, priority),
+        'FetchScheduler': FinishingFetcher,
+    }
+    saved = {name: getattr(lcdtimedate, name) for name in patches}
+    with patched(result.bus):
+        for name, value in patches.items():
+            setattr(lcdtimedate, name, value)
+        # an hour of earlier quotes, so the sparkline screen has a series to draw
+        now = time()
+        for symbol in lcdtimedate.stock_symbols:
+            for minute in range(60, 0, -4):
+                lcdtimedate.price_history.record(symbol, 170 + minute % 9, now - minute * 60)
+        start = perf_counter()
+        try:
+            lcdtimedate.main()
+        except CycleDone:
+            pass
+        finally:
+            result.wall = perf_counter() - start
+            for name, value in saved.items():
+                setattr(lcdtimedate, name, value)
+    return result
+
+# Timings of a cold start, measured from before the interpreter is launched
+class StartupResult:
+    def __init__(self):
+        self.marks = {}
+
+    def report(self):
+        marks = ''.join(f"{name}={seconds * 1000:8.1f} ms  " for name, seconds in self.marks.items())
+        return f"{'startup':<10} {marks}".rstrip()
+
+# Benchmark: a fresh process from launch to the first LCD frame, and to the
+# end of the background data load
+def bench_startup():
+    result = StartupResult()
+    start = time()
+    child = subprocess.run([sys.executable, os.path.abspath(__file__), '--startup-child'],
+                           capture_output=True, text=True, timeout=60)
+    for line in child.stdout.splitlines():
+        name, _, stamp = line.partition(' ')
+        if name in ('imported', 'first_frame', 'data_loaded'):
+            result.marks[name] = float(stamp) - start
+    if child.returncode != 0 or 'first_frame' not in result.marks:
+        print(child.stderr, file=sys.stderr)
+    return result
+
+# Child side of bench_startup: runs main() until the first frame is flushed,
+# with the state files in a scratch directory
+def startup_child(imported):
+    print(f"imported {imported}", flush=True)
+    result = Result('startup')
+    lcd = make_lcd(result)
+    flush = lcd.lcd_flush
+
+    def first_flush():
+        flush()
+        print(f"first_frame {time()}", file=sys.__stdout__, flush=True)
+        raise CycleDone()
+    lcd.lcd_flush = first_flush
+
+    with tempfile.TemporaryDirectory() as scratch:
+        for state in (lcdtimedate.stock_cache, lcdtimedate.api_budget, lcdtimedate.price_history, lcdtimedate.weather_cache,
+                      lcdtimedate.state_snapshot):
+            state.path = os.path.join(scratch, os.path.basename(state.path))
+        lcdtimedate.message_corpus.cache_path = os.path.join(scratch, 'message_cache.json')
+        lcdtimedate.LOG_DIR = os.path.join(scratch, 'logs')
+        lcdtimedate.initialize_lcd = lambda *args, **kwargs: lcd
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                lcdtimedate.main()
+        except CycleDone:
+            pass
+        if lcdtimedate.data_loaded.wait(30):
+            print(f"data_loaded {time()}", flush=True)
+        lcdtimedate.stock_cache.flush()
+        lcdtimedate.price_history.close()
+    return 0
+
+# Check that the glyphs a slot on the glass refers to are in the emulator's
+# CGRAM under that slot; raises AssertionError naming the first that isn't
+def check_glyphs(lcd, bus):
+    for char, slot in lcd.glyphs.resident.items():
+        if bus.glyph(slot) != lcd_glyphs.GLYPHS[char]:
+            raise AssertionError(f"CGRAM slot {slot} does not hold {char!r}")
+    for row, line in zip(lcd.shadow, bus.lines()):
+        if ''.join(row) != line:
+            raise AssertionError(f"glass shows {line!r}, shadow has {''.join(row)!r}")
+
+# Benchmark and check: a brown-out wipes CGRAM while a frame with glyphs is
+# shown; after the resync the visible glyphs are uploaded again and one that
+# was dropped is uploaded when it is next used
+def bench_resync():
+    result = Result('resync')
+    lcd = make_lcd(result)
+    bus = result.bus
+    frames = [("AAPL 1.00 \u2191 \u2600", "72\u00b0F"), ("AAPL 1.00 \u2191", "72\u00b0F"),
+              None, ("Clear \u2600", "72\u00b0F")]
+    start = perf_counter()
+    for frame in frames:
+        if frame is None:
+            bus.cgram[:] = [0] * len(bus.cgram)
+            lcd.lcd_resync()
+            continue
+        lcd.lcd_buffer_clear()
+        lcd.lcd_buffer_string(frame[0], 1)
+        lcd.lcd_buffer_string(frame[1], 2)
+        lcd.lcd_flush()
+        check_glyphs(lcd, bus)
+    result.wall = perf_counter() - start
+    if u'\u2600' not in lcd.glyphs.resident:
+        raise AssertionError("the sun glyph was not uploaded again after the resync")
+    return result
+
+BENCHMARKS = {
+    'tick': bench_tick,
+    'opening': bench_opening,
+    'cycle': bench_cycle,
+    'startup': bench_startup,
+    'resync': bench_resync,
+}
+
+def main(argv):
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name} (choose from {', '.join(BENCHMARKS)})")
+            return 1
+        print(BENCHMARKS[name]().report())
+    return 0
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['--startup-child']:
+        sys.exit(startup_child(imported))
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,122 @@
+# Signally LCD / local control API
+#
+# A small JSON-over-HTTP server on localhost, run by asyncio on its own
+# thread. Handlers are plain functions taking the decoded request body and
+# returning (status, body); they run on a worker thread of the event loop, so
+# reading files or waiting on a lock never stalls the server, and nothing here
+# runs on the display thread. Changes reach the display loop through
+# thread-safe state (a message queue and the frame scheduler's preempt event).
+# POSTs must be sent as application/json: a web page can't send that cross
+# origin without a CORS preflight, which is never answered, so a browser on
+# the Pi can't be used to drive the API.
+#
+#   curl -H 'Content-Type: application/json' -d '{"text": "Stand-up in 5"}' http://127.0.0.1:9106/message
+#   curl http://127.0.0.1:9106/state
+import json
+import asyncio
+import threading
+
+# Largest request body accepted
+MAX_BODY = 64 * 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 415: 'Unsupported Media Type', 500: 'Internal Server Error'}
+
+class ControlServer:
+    # routes maps (method, path) to handler(body) -> (status, body); a str
+    # body is sent as text/plain, anything else as JSON
+    def __init__(self, routes, host='127.0.0.1', port=9106):
+        self.routes = dict(routes)
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.started = threading.Event()
+        self.error = None
+
+    # Start serving on a background thread; raises OSError if the port is taken
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='control-server', daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle, self.host, self.port))
+            self.port = self.server.sockets[0].getsockname()[1]
+        except OSError as e:
+            self.error = e
+            self.started.set()
+            self.loop.close()
+            return
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+    def stop(self):
+        if self.loop is not None and self.thread is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    async def handle(self, reader, writer):
+        try:
+            status, body = await self.respond(reader)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            status, body = 400, {'error': 'malformed request'}
+        if isinstance(body, str):
+            payload, content_type = body.encode('utf-8'), 'text/plain; charset=utf-8'
+        else:
+            payload, content_type = json.dumps(body).encode('utf-8'), 'application/json'
+        writer.write(f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(payload)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('ascii') + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def respond(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) < 2:
+            raise ValueError("bad request line")
+        method, target = request_line[0].upper(), request_line[1]
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY:
+            return 413, {'error': 'request body too large'}
+        content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+        if method != 'GET' and content_type != 'application/json':
+            return 415, {'error': 'Content-Type must be application/json'}
+        raw = await reader.readexactly(length) if length else b''
+        try:
+            body = json.loads(raw) if raw.strip() else {}
+        except ValueError:
+            return 400, {'error': 'body must be JSON'}
+
+        path = target.split('?')[0]
+        handler = self.routes.get((method, path))
+        if handler is None:
+            allowed = any(route_path == path for _, route_path in self.routes)
+            return (405, {'error': 'method not allowed'}) if allowed else (404, {'error': 'not found'})
+        try:
+            return await self.loop.run_in_executor(None, handler, body)
+        except Exception as e:
+            return 500, {'error': str(e)}
@@ -0,0 +1,228 @@
+# Signally LCD / multi-panel display manager
+#
+# Drives several LCDs, on any mix of I2C addresses and buses, from one
+# process. Every panel runs its own playlist on its own thread and frame
+# scheduler, but no panel thread touches the bus: its driver writes into a
+# PanelDevice, which queues the bytes for the one worker thread that owns that
+# bus. The worker sends a single chunk (at most one I2C block) for each panel
+# in turn, so a long write on one panel (a glyph upload, a marquee line) can't
+# hold up the clock on another panel sharing the bus, while panels on
+# different buses are written in parallel. LCD execution delays are kept per
+# panel and never stall the bus for the others.
+import sys
+import threading
+from collections import deque
+from time import monotonic
+
+sys.path.append('./I2C_LCD_driver')
+import I2C_LCD_driver
+from frame_scheduler import FrameScheduler
+from supervisor import Supervisor
+
+# Bytes sent for one panel before the worker moves on to the next
+CHUNK_SIZE = I2C_LCD_driver.I2C_BLOCK_MAX + 1
+
+# Bytes a panel may have queued before its writes block (~0.1 s of bus time)
+MAX_PENDING = 1024
+
+# Owns one I2C bus and writes queued panel traffic to it round-robin
+class BusWorker:
+    def __init__(self, port, transport=None):
+        self.port = port
+        self.transport = transport if transport is not None else I2C_LCD_driver.open_transport(port, shared=True)
+        self.condition = threading.Condition()
+        self.devices = {}     # address -> i2c_device on this bus
+        self.queues = {}      # address -> deque of byte chunks and delays (floats)
+        self.pending = {}     # address -> bytes queued
+        self.ready_at = {}    # address -> monotonic time the panel may be written again
+        self.order = deque()  # addresses, next to be served first
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name=f"i2c-{port}", daemon=True)
+        self.thread.start()
+
+    # i2c_device for a panel address on this bus
+    def device(self, address):
+        with self.condition:
+            if address not in self.devices:
+                self.devices[address] = I2C_LCD_driver.i2c_device(address, self.port, self.transport)
+                self.queues[address] = deque()
+                self.pending[address] = 0
+                self.ready_at[address] = 0.0
+                self.order.append(address)
+            return self.devices[address]
+
+    # Queue bytes for a panel, blocking while it is too far behind
+    def submit(self, address, data):
+        with self.condition:
+            while self.pending[address] >= MAX_PENDING and not self.stopping:
+                self.condition.wait()
+            queue = self.queues[address]
+            for i in range(0, len(data), CHUNK_SIZE):
+                queue.append(bytes(data[i:i + CHUNK_SIZE]))
+            self.pending[address] += len(data)
+            self.condition.notify_all()
+
+    # Let a panel's controller execute for seconds before its next bytes
+    def pause(self, address, seconds):
+        with self.condition:
+            self.queues[address].append(float(seconds))
+            self.condition.notify_all()
+
+    # Wait until everything queued for address has been written
+    def drain(self, address, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queues[address] or self.stopping, timeout)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    # Next (address, chunk) in round-robin order, or the seconds until a
+    # paused panel becomes writable (None if nothing is queued). Called with
+    # the condition held.
+    def next_chunk(self):
+        now = monotonic()
+        wake = None
+        for _ in range(len(self.order)):
+            address = self.order[0]
+            self.order.rotate(-1)
+            queue = self.queues[address]
+            while queue and isinstance(queue[0], float) and self.ready_at[address] <= now:
+                self.ready_at[address] = now + queue.popleft()
+            if not queue:
+                continue
+            if self.ready_at[address] > now:
+                wait = self.ready_at[address] - now
+                wake = wait if wake is None else min(wake, wait)
+                continue
+            return address, queue.popleft()
+        return None, wake
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    address, chunk = self.next_chunk()
+                    if address is not None:
+                        break
+                    if self.stopping:
+                        return
+                    self.condition.wait(chunk)
+            try:
+                self.devices[address].write_bytes(chunk)
+            except Exception as e:
+                print(f"Error writing to LCD 0x{address:02x} on bus {self.port}: {e}")
+            with self.condition:
+                self.pending[address] -= len(chunk)
+                self.condition.notify_all()
+
+# Stands in for I2C_LCD_driver.i2c_device: writes and delays go through the
+# panel's bus worker instead of straight to the bus
+class PanelDevice:
+    def __init__(self, worker, address):
+        self.worker = worker
+        self.address = address
+        self.device = worker.device(address)
+
+    def write_cmd(self, cmd):
+        self.worker.submit(self.address, [cmd])
+        self.worker.pause(self.address, 0.0001)
+
+    def write_bytes(self, data):
+        if data:
+            self.worker.submit(self.address, data)
+
+    def delay(self, seconds):
+        self.worker.pause(self.address, seconds)
+
+    def drain(self, timeout=None):
+        return self.worker.drain(self.address, timeout)
+
+    # transfer statistics of the underlying device
+    @property
+    def bytes_written(self):
+        return self.device.bytes_written
+
+    @property
+    def transactions(self):
+        return self.device.transactions
+
+    @property
+    def busy_time(self):
+        return self.device.busy_time
+
+    @property
+    def reconnects(self):
+        return self.device.reconnects
+
+    # called on the bus worker's thread after the device has been reopened
+    @property
+    def on_reconnect(self):
+        return self.device.on_reconnect
+
+    @on_reconnect.setter
+    def on_reconnect(self, callback):
+        self.device.on_reconnect = callback
+
+    def bytes_per_second(self):
+        return self.device.bytes_per_second()
+
+# One LCD and what it shows: play(lcd, scheduler) runs its display loop
+class Panel:
+    def __init__(self, name, lcd, play, scheduler=None):
+        self.name = name
+        self.lcd = lcd
+        self.play = play
+        self.scheduler = scheduler if scheduler is not None else FrameScheduler()
+        self.thread = None
+        self.error = None
+
+    # play() is rerun after a failure, until the supervisor gives up
+    def run(self):
+        try:
+            Supervisor().run(lambda: self.play(self.lcd, self.scheduler), self.restart)
+        except Exception as e:
+            self.error = e
+            print(f"Panel {self.name} stopped: {e}")
+
+    def restart(self, error):
+        try:
+            self.lcd.lcd_resync()
+        except OSError as e:
+            print(f"Error resyncing panel {self.name}: {e}")
+
+class DisplayManager:
+    def __init__(self):
+        self.workers = {}
+        self.panels = []
+
+    # Bus worker for port, started on first use
+    def worker(self, port, transport=None):
+        if port not in self.workers:
+            self.workers[port] = BusWorker(port, transport)
+        return self.workers[port]
+
+    # Initialize the LCD at address on bus port and add it as a panel; it gets
+    # a frame scheduler of its own unless one is given. warm keeps what the
+    # LCD shows (see I2C_LCD_driver.lcd).
+    def add_panel(self, name, play, address=I2C_LCD_driver.ADDRESS, port=I2C_LCD_driver.I2CBUS, transport=None,
+                  scheduler=None, warm=False):
+        device = PanelDevice(self.worker(port, transport), address)
+        lcd = I2C_LCD_driver.lcd(address=address, port=port, device=device, warm=warm)
+        panel = Panel(name, lcd, play, scheduler)
+        self.panels.append(panel)
+        return panel
+
+    # Run every panel on its own thread until they all return
+    def run(self):
+        for panel in self.panels:
+            panel.thread = threading.Thread(target=panel.run, name=f"panel-{panel.name}", daemon=True)
+            panel.thread.start()
+        for panel in self.panels:
+            panel.thread.join()
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
@@ -0,0 +1,230 @@
+# Signally LCD / structured event log
+#
+# What the display showed, as JSON lines in rotating segment files. Screens log
+# the same text once a second for the whole phase, so consecutive entries with
+# the same text are collapsed into one run record:
+#
+#   {"start": "2026-10-17T09:30:00", "end": "2026-10-17T09:30:29", "count": 30, "text": "Oct 17, 2026"}
+#
+# The active segment is rotated when it reaches max_bytes or max_age seconds;
+# finished segments are gzipped, and segments older than retention_days (or
+# beyond max_total_bytes) are deleted. The HTML log is no longer kept up to
+# date while running: `python event_log.py report` renders it from the
+# segments on demand with style_log_template.html.
+import os
+import sys
+import gzip
+import html
+import json
+import shutil
+from datetime import datetime, timedelta
+from time import monotonic
+
+DEFAULT_DIRECTORY = 'logs'
+DEFAULT_TEMPLATE = 'style_log_template.html'
+ENTRIES_PLACEHOLDER = "{log_entries}"
+
+# A run is written out once it spans this long even if the text hasn't changed
+MAX_RUN_SECONDS = 300
+
+class EventLog:
+    def __init__(self, directory=DEFAULT_DIRECTORY, prefix='events', max_bytes=1 << 20, max_age=24 * 3600,
+                 retention_days=30, max_total_bytes=64 << 20, compress=True, flush_interval=5.0):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.retention_days = retention_days
+        self.max_total_bytes = max_total_bytes
+        self.compress = compress
+        self.flush_interval = flush_interval
+
+        self.file = None
+        self.path = None
+        self.opened = None
+        self.size = 0
+        self.run = None
+        self.pending = []
+        self.last_flush = monotonic()
+
+        # counters
+        self.entries = 0
+        self.records = 0
+        self.rotations = 0
+
+    # Add one displayed entry; line2 (the time of day) is implied by the timestamp
+    def write(self, line1, line2=None, timestamp=None):
+        timestamp = timestamp or datetime.now()
+        self.entries += 1
+        run = self.run
+        if run is not None and run['text'] == line1 and (timestamp - run['start']).total_seconds() < MAX_RUN_SECONDS:
+            run['end'] = timestamp
+            run['count'] += 1
+        else:
+            self.end_run()
+            self.run = {'start': timestamp, 'end': timestamp, 'count': 1, 'text': line1}
+        if monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def end_run(self):
+        run = self.run
+        if run is None:
+            return
+        self.run = None
+        record = {'start': run['start'].isoformat(timespec='seconds')}
+        if run['count'] > 1:
+            record['end'] = run['end'].isoformat(timespec='seconds')
+        record['count'] = run['count']
+        record['text'] = run['text']
+        self.pending.append(json.dumps(record, ensure_ascii=False) + '\n')
+
+    # Write finished runs to the active segment, rotating it first if due
+    def flush(self):
+        self.last_flush = monotonic()
+        if not self.pending:
+            return
+        if self.file is not None and (self.size >= self.max_bytes or monotonic() - self.opened >= self.max_age):
+            self.rotate()
+        self.open()
+        data = ''.join(self.pending).encode('utf-8')
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+        self.records += len(self.pending)
+        self.pending = []
+
+    # Write out the open run and close the active segment
+    def close(self):
+        self.end_run()
+        try:
+            self.flush()
+        finally:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def open(self):
+        if self.file is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # segments left by an earlier run are finished off first
+        self.finish_segments()
+        stamp = f"{datetime.now():%Y%m%d-%H%M%S}"
+        self.path = os.path.join(self.directory, f"{self.prefix}-{stamp}.jsonl")
+        serial = 0
+        while os.path.exists(self.path + '.gz'):  # rotated twice within a second
+            serial += 1
+            self.path = os.path.join(self.directory, f"{self.prefix}-{stamp}-{serial}.jsonl")
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+        self.opened = monotonic()
+
+    # Close the active segment and start a new one on the next flush
+    def rotate(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.rotations += 1
+        self.finish_segments()
+
+    # Compress finished segments and apply retention
+    def finish_segments(self):
+        active = self.path if self.file is not None else None
+        if self.compress:
+            for path in segment_paths(self.directory, self.prefix):
+                if path.endswith('.jsonl') and path != active:
+                    compress_segment(path)
+        self.apply_retention(active)
+
+    def apply_retention(self, active=None):
+        cutoff = datetime.now() - timedelta(days=self.retention_days)
+        paths = [path for path in segment_paths(self.directory, self.prefix) if path != active]
+        total = sum(os.path.getsize(path) for path in paths)
+        for path in paths:  # oldest first
+            if segment_time(path) >= cutoff and total <= self.max_total_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+# gzip a finished segment in place of the plain file
+def compress_segment(path):
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+
+# Segment files for prefix in the directory, oldest first
+def segment_paths(directory, prefix='events'):
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    names = [name for name in names
+             if name.startswith(prefix + '-') and (name.endswith('.jsonl') or name.endswith('.jsonl.gz'))]
+    return [os.path.join(directory, name) for name in sorted(names, key=segment_order)]
+
+# Sort key for segment names: start time, then the serial of same-second rotations
+def segment_order(name):
+    stamp = name.split('-', 1)[1].split('.')[0]  # 20261017-093000, or 20261017-093000-2
+    serial = stamp[16:]
+    return (stamp[:15], int(serial) if serial.isdigit() else 0)
+
+# When a segment was started, from its file name
+def segment_time(path):
+    stamp = os.path.basename(path).split('-', 1)[1][:15]
+    try:
+        return datetime.strptime(stamp, '%Y%m%d-%H%M%S')
+    except ValueError:
+        return datetime.fromtimestamp(os.path.getmtime(path))
+
+# Stream run records from every segment, oldest first
+def iter_records(directory=DEFAULT_DIRECTORY, prefix='events', since=None):
+    for path in segment_paths(directory, prefix):
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            with opener(path, 'rt', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    if since is None or record.get('end', record['start']) >= since:
+                        yield record
+        except (OSError, EOFError) as e:
+            print(f"Error reading {path}: {e}", file=sys.stderr)
+
+# Render the HTML log from the segments into out, one entry at a time
+def write_html_report(out, directory=DEFAULT_DIRECTORY, template_path=DEFAULT_TEMPLATE, since=None):
+    with open(template_path, 'r') as template_file:
+        template = template_file.read()
+    head, _, trailer = template.partition(ENTRIES_PLACEHOLDER)
+    out.write(head.replace("{created_date}", datetime.now().strftime("%B %d, %Y | %I:%M %p")))
+    for record in iter_records(directory, since=since):
+        start = record['start'].replace('T', ' ')
+        span = f" (x{record['count']} until {record['end'].replace('T', ' ')})" if 'end' in record else ''
+        out.write(f"<div class='log-entry'><strong>{start}</strong>: {html.escape(record['text'])}{span}</div>\n")
+    out.write(trailer)
+
+# Command line: python event_log.py report [--since YYYY-MM-DD] [--dir logs] [output.html]
+def main(argv):
+    if not argv or argv[0] != 'report':
+        print("usage: python event_log.py report [--since YYYY-MM-DD] [--dir DIRECTORY] [output.html]")
+        return 2
+    args = argv[1:]
+    options = {'--since': None, '--dir': DEFAULT_DIRECTORY}
+    output = None
+    while args:
+        arg = args.pop(0)
+        if arg in options and args:
+            options[arg] = args.pop(0)
+        else:
+            output = arg
+
+    if output is None:
+        write_html_report(sys.stdout, options['--dir'], since=options['--since'])
+    else:
+        with open(output, 'w', encoding='utf-8') as out:
+            write_html_report(out, options['--dir'], since=options['--since'])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,64 @@
+# Signally LCD / background fetch scheduler
+#
+# Runs network fetches on a small thread pool so the display loop never waits
+# on a socket. Requests (the next stock quote, a weather refresh) are started
+# early and picked up when ready; the display code only ever reads values from
+# memory. While paused (quiet hours) no new request is started; the screens
+# ask again once the display is awake.
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class FetchScheduler:
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+        self.lock = threading.Lock()
+        self.results = {}
+        self.in_flight = set()
+        self.paused = False
+
+    # Start a single fetch now; its value is picked up with take(name).
+    # False if one is already in flight or fetching is paused.
+    def request(self, name, fetch, *args):
+        with self.lock:
+            if self.paused or name in self.in_flight:
+                return False
+            self.in_flight.add(name)
+            self.results.pop(name, None)
+        self.executor.submit(self.run_fetch, name, fetch, args)
+        return True
+
+    # Remove and return a ready value, or default if it is not ready
+    def take(self, name, default=None):
+        with self.lock:
+            return self.results.pop(name, default)
+
+    def pending(self, name):
+        with self.lock:
+            return name in self.in_flight
+
+    # Start no new fetches until resume(); those in flight still finish
+    def pause(self):
+        with self.lock:
+            self.paused = True
+
+    def resume(self):
+        with self.lock:
+            self.paused = False
+
+    # A stopped scheduler stays paused, so late requests are refused
+    def stop(self):
+        self.pause()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def run_fetch(self, name, fetch, args):
+        try:
+            value = fetch(*args)
+        except Exception as e:
+            # the fetchers report their own errors
+            print(f"Error in background fetch {name}: {e}")
+            with self.lock:
+                self.in_flight.discard(name)
+            return
+        with self.lock:
+            self.results[name] = value
+            self.in_flight.discard(name)
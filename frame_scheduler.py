@@ -0,0 +1,90 @@
+# Signally LCD / deadline-based frame scheduler
+#
+# Replaces `for _ in range(N): ...; sleep(1)` loops. Frames are due on
+# time.monotonic() deadlines aligned to wall-clock second boundaries, so the
+# work done in a frame does not push the next one later and the clock neither
+# drifts nor skips. A frame that could not be rendered before the following
+# deadline is counted as missed and skipped rather than rendered late.
+# Setting preempt ends the current run() early (e.g. for a pushed message).
+# next_beat is the monotonic time the next frame is due, for the watchdog.
+import math
+import threading
+from datetime import datetime
+from time import monotonic, perf_counter, time
+
+from metrics import Histogram
+
+class FrameScheduler:
+    def __init__(self, period=1.0):
+        self.period = period
+        self.preempt = threading.Event()
+        self.next_beat = None
+        self.sleep = self.wait
+        self.monotonic = monotonic
+        self.time = time
+
+        # statistics, see stats()
+        self.frames = 0
+        self.missed = 0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+        self.render_time = Histogram('signally_frame_render_seconds', 'Time spent rendering one frame')
+
+    # Call render(now) once per period for `frames` frames. now is the wall
+    # clock time of the boundary the frame belongs to. period defaults to the
+    # scheduler's own (one second).
+    def run(self, frames, render, period=None):
+        period = period or self.period
+        wall = self.time()
+        boundary = math.ceil(wall / period) * period
+        deadline = self.monotonic() + (boundary - wall)
+
+        rendered = 0
+        while rendered < frames:
+            self.next_beat = deadline
+            remaining = deadline - self.monotonic()
+            if remaining > 0:
+                self.sleep(remaining)
+            if self.preempt.is_set():
+                break
+
+            late = self.monotonic() - deadline
+            if late >= period:
+                # too late for this boundary (and maybe more); skip to the current one
+                skipped = min(int(late // period), frames - rendered)
+                self.missed += skipped
+                rendered += skipped
+                deadline += skipped * period
+                boundary += skipped * period
+                late -= skipped * period
+                if rendered >= frames:
+                    break
+
+            jitter = max(late, 0.0)
+            self.last_jitter = jitter
+            self.max_jitter = max(self.max_jitter, jitter)
+            self.total_jitter += jitter
+            self.frames += 1
+
+            start = perf_counter()
+            render(datetime.fromtimestamp(boundary))
+            self.render_time.observe(perf_counter() - start)
+            rendered += 1
+            deadline += period
+            boundary += period
+
+    # Tell the watchdog the caller will be busy (e.g. idle) for seconds
+    def expect(self, seconds):
+        self.next_beat = self.monotonic() + seconds
+
+    # Sleep that returns early when preempt is set
+    def wait(self, seconds):
+        self.preempt.wait(seconds)
+
+    def stats(self):
+        return {'frames': self.frames,
+                'missed': self.missed,
+                'last_jitter': self.last_jitter,
+                'max_jitter': self.max_jitter,
+                'mean_jitter': self.total_jitter / self.frames if self.frames else 0.0}
@@ -1,55 +1,165 @@
 # Signally LCD / Aaron O Hall
 import sys
 import os
-import requests
-from datetime import datetime, time, timedelta
+import threading
+from datetime import datetime, time
 from time import sleep
-from dotenv import load_dotenv
 import random
-import json
+import atexit
+from collections import deque
+from log_writer import AsyncLogWriter
+from event_log import EventLog
+from fetch_scheduler import FetchScheduler
+from api_client import ApiClient, ApiError
+from quote_cache import QuoteCache
+from api_budget import ApiBudget, Provider, pick_symbols
+from frame_scheduler import FrameScheduler
+from screens import Playlist, clock_screen, two_line_screen
+from message_corpus import MessageCorpus, layout, parse_line
+from price_history import PriceHistory, sparkline
+from weather_cache import WeatherCache
+from display_manager import DisplayManager
+from power import PowerManager, IdleScreen, SocketWake, GpioWake, parse_quiet_hours, QUIET_OFF, QUIET_CLOCK
+import metrics
+from metrics import MetricsServer, Snapshot
+from control_server import ControlServer
+from supervisor import StateSnapshot, Supervisor, Watchdog, exit_stalled
 
 # Import the LCD driver module
 sys.path.append('./I2C_LCD_driver')
 import I2C_LCD_driver
 
-# Load environment variables from .env file
-load_dotenv()
+# Function to load environment variables from the .env file, if python-dotenv
+# is installed
+def load_env():
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+load_env()
 
-# Load API keys and city from environment variables
+# Load API keys and city from environment variables. Features whose keys are
+# missing are switched off and the display runs without them (offline mode).
 OPENWEATHERMAP_API_KEY = os.getenv('OPENWEATHERMAP_API_KEY')
 ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
 RAPIDAPI_KEY = os.getenv('RAPIDAPI_KEY')
 CITY = os.getenv('CITY_NAME')
 
-# Ensure required environment variables are set
-if not all([OPENWEATHERMAP_API_KEY, ALPHA_VANTAGE_API_KEY, RAPIDAPI_KEY, CITY]):
-    print("Missing required environment variables.")
-    sys.exit(1)
+# Seconds each screen stays up in the display cycle
+PLAYLIST = {
+    'date': 30,
+    'stock': 30,
+    'weather': 15,
+    'message': 25,
+    'historical': 25,
+    'sparkline': 15,
+    'forecast': 10,
+}
+
+# Ticks every screen on wall-clock second boundaries
+frame_scheduler = FrameScheduler()
 
 # Load data from files
 POSITIVE_MESSAGES_FILE = 'positive_messages.txt'
 WELLNESS_MESSAGES_FILE = 'wellness_messages.txt'
 HISTORICAL_MESSAGES_FILE = 'historical_messages.txt'
+MESSAGE_CACHE_FILE = '.message_cache.json'
 STOCK_SYMBOLS_FILE = 'stock_symbols.txt'
-LOG_FILE = 'log_lcd_screen.txt'
-HTML_LOG_FILE = 'log_lcd_screen.html'
-LAST_DELETION_FILE = 'last_deletion.txt'
+LOG_DIR = 'logs'
 STOCK_CACHE_FILE = 'stock_cache.json'
+LEGACY_STOCK_CACHE_FILE = 'stock_cache.txt'
+STOCK_CACHE_TTL = 1800  # seconds a quote stays fresh
+API_BUDGET_FILE = 'api_budget.json'
+PRICE_HISTORY_FILE = 'price_history.bin'
+WEATHER_CACHE_FILE = 'weather_cache.json'
+LOG_FLUSH_INTERVAL = 5  # seconds between batched log writes
+LOG_SEGMENT_BYTES = 1 << 20  # rotate the event log at this size...
+LOG_SEGMENT_AGE = 24 * 3600  # ...or after this many seconds
+LOG_RETENTION_DAYS = 30
+LOG_QUEUE_SIZE = 256  # entries buffered for the log writer thread
 
-# Function to load messages from a file
-def load_messages(filename):
-    try:
-        with open(filename, 'r') as file:
-            messages = [line.strip() for line in file if line.strip()]
-        return messages
-    except Exception as e:
-        print(f"Error loading messages from {filename}: {e}")
-        return []
+# API endpoints (overridable, e.g. to point at a local stub server)
+OPENWEATHERMAP_URL = os.getenv('OPENWEATHERMAP_URL', 'http://api.openweathermap.org/data/2.5/weather')
+OPENWEATHERMAP_FORECAST_URL = os.getenv('OPENWEATHERMAP_FORECAST_URL', 'http://api.openweathermap.org/data/2.5/forecast')
+ALPHA_VANTAGE_URL = os.getenv('ALPHA_VANTAGE_URL', 'https://www.alphavantage.co/query')
+RAPIDAPI_URL = os.getenv('RAPIDAPI_URL', 'https://yahoo-finance127.p.rapidapi.com')
+RAPIDAPI_HOST = 'yahoo-finance127.p.rapidapi.com'
+
+# Batch quote fetching: symbols requested per API call
+ALPHA_VANTAGE_BULK = os.getenv('ALPHA_VANTAGE_BULK', '0') == '1'  # premium keys only
+ALPHA_VANTAGE_BATCH_SIZE = 100
+RAPIDAPI_BATCH_SIZE = 10
+STOCK_REFRESH_AGE = 20 * 60  # don't spend a call on quotes younger than this
+
+# Network timeouts in seconds: (connect, read)
+REQUEST_TIMEOUT = (3.05, 10)
+
+# Background fetching
+FETCH_WORKERS = 2
+
+# Weather is served from the cache and refreshed in the background once the
+# observation or the forecast is older than these many seconds; an observation
+# older than WEATHER_MAX_AGE is replaced on screen by the forecast for the hour
+WEATHER_REFRESH_AGE = 30 * 60
+FORECAST_REFRESH_AGE = 3 * 3600
+WEATHER_MAX_AGE = 3 * 3600
+FORECAST_SLOTS = 8  # 3-hour forecast slots fetched per call (24 hours)
+
+# LCD panels as content@bus:address, comma separated, e.g.
+# "main@1:0x3f,clock@1:0x27,weather@0:0x3f". Empty for the single default LCD.
+# Content is one of PANEL_CONTENT; only the main panel writes the event log.
+LCD_PANELS = os.getenv('LCD_PANELS', '')
+PANEL_CONTENT = ('main', 'clock', 'weather', 'messages')
+
+# Quiet hours (HH:MM-HH:MM, e.g. 23:00-06:00; off unless set): the backlight
+# goes off, fetching pauses and the LCD is either switched off (QUIET_MODE=off)
+# or shows a clock updated once a minute (QUIET_MODE=clock). A wake event brings the full
+# display back for WAKE_DURATION seconds; wake sources are a Unix datagram
+# socket (WAKE_SOCKET=path) and a GPIO button (WAKE_GPIO_PIN=pin).
+QUIET_HOURS = os.getenv('QUIET_HOURS', '')
+QUIET_MODE = os.getenv('QUIET_MODE', 'clock')
+WAKE_DURATION = 300
+WAKE_SOCKET = os.getenv('WAKE_SOCKET', '')
+WAKE_GPIO_PIN = os.getenv('WAKE_GPIO_PIN', '')
+
+# Local metrics endpoint; set METRICS_PORT to an empty string to turn it off
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = os.getenv('METRICS_PORT', '9105')
+
+# Local control API (push messages, reload files, change settings, read the
+# display state); set CONTROL_PORT to an empty string to turn it off
+CONTROL_HOST = '127.0.0.1'
+CONTROL_PORT = os.getenv('CONTROL_PORT', '9106')
+PRIORITY_MESSAGE_DURATION = 30  # default seconds a pushed message stays up
+MAX_PRIORITY_MESSAGES = 16  # pushed messages waiting beyond this are dropped, oldest first
+
+# A restart within SNAPSHOT_MAX_AGE seconds of the last snapshot resumes the
+# playlist where it was, without the opening animation or clearing the LCD.
+# The process exits (for the service manager to restart it) if a display
+# loop renders no frame for WATCHDOG_TIMEOUT seconds; set it to an empty
+# string to turn the watchdog off.
+STATE_SNAPSHOT_FILE = 'state_snapshot.json'
+SNAPSHOT_MAX_AGE = 120
+WATCHDOG_TIMEOUT = os.getenv('WATCHDOG_TIMEOUT', '60')
+WATCHDOG_INTERVAL = 5  # seconds between watchdog checks and snapshot saves
 
-# Load positive, wellness, and historical messages
-positive_messages = load_messages(POSITIVE_MESSAGES_FILE)
-wellness_messages = load_messages(WELLNESS_MESSAGES_FILE)
-historical_messages = load_messages(HISTORICAL_MESSAGES_FILE)
+# Fetch outcomes per API provider
+fetch_results = metrics.registry.counter('signally_fetch_total', 'API fetches by provider and result',
+                                         ('provider', 'result'))
+metrics.registry.add(frame_scheduler.render_time)
+
+# Pooled keep-alive HTTP client shared by all API fetchers
+api_client = ApiClient(timeout=REQUEST_TIMEOUT)
+
+# Positive, wellness and historical messages, laid out for the LCD once and
+# re-read when a file changes
+message_corpus = MessageCorpus({
+    'positive': POSITIVE_MESSAGES_FILE,
+    'wellness': WELLNESS_MESSAGES_FILE,
+    'historical': HISTORICAL_MESSAGES_FILE,
+}, cache_path=MESSAGE_CACHE_FILE)
 
 # Function to load stock symbols from a file
 def load_stock_symbols(filename):
@@ -61,302 +171,447 @@ def load_stock_symbols(filename):
         print(f"Error loading stock symbols: {e}")
         return []
 
-# Load stock symbols
-stock_symbols = load_stock_symbols(STOCK_SYMBOLS_FILE)
+# Stock symbols, read by load_data()
+stock_symbols = []
+
+# Function to (re)read the watchlist; the list is swapped in whole, so the
+# display thread sees either the old or the new one
+def reload_stock_symbols():
+    global stock_symbols
+    stock_symbols = load_stock_symbols(STOCK_SYMBOLS_FILE)
+    return stock_symbols
+
+# Stock quote cache; changes are written back in the background
+stock_cache = QuoteCache(STOCK_CACHE_FILE, STOCK_CACHE_TTL, legacy_path=LEGACY_STOCK_CACHE_FILE)
+atexit.register(stock_cache.flush)
+
+# Fixed-size per-symbol price history, memory-mapped from disk
+price_history = PriceHistory(PRICE_HISTORY_FILE)
+atexit.register(price_history.close)
+
+# Current weather and forecast, kept across restarts
+weather_cache = WeatherCache(WEATHER_CACHE_FILE, WEATHER_REFRESH_AGE, FORECAST_REFRESH_AGE, WEATHER_MAX_AGE)
+
+# Playlist position and what was on screen, for a warm restart
+state_snapshot = StateSnapshot(STATE_SNAPSHOT_FILE, SNAPSHOT_MAX_AGE)
+
+# Restarts the main display loop after a failure
+supervisor = Supervisor()
 
-# Function to initialize the LCD display
-def initialize_lcd():
+# Function to read the quiet hours setting, ignoring it if malformed
+def load_quiet_hours(spec):
     try:
-        lcd = I2C_LCD_driver.lcd()
-        
-        # Define custom character for degree symbol
-        degree_symbol = [
-            0b01100,
-            0b10010,
-            0b10010,
-            0b01100,
-            0b00000,
-            0b00000,
-            0b00000,
-            0b00000,
-        ]
-        lcd.lcd_load_custom_chars([degree_symbol])
-        return lcd
+        return parse_quiet_hours(spec)
+    except ValueError:
+        print(f"Ignoring QUIET_HOURS={spec!r}: expected HH:MM-HH:MM")
+        return None
+
+# Display power schedule
+power = PowerManager(load_quiet_hours(QUIET_HOURS), QUIET_MODE, WAKE_DURATION)
+
+# Daily call budgets and call windows per stock provider, kept across restarts
+api_budget = ApiBudget(API_BUDGET_FILE, [
+    Provider('alpha_vantage', daily_limit=25, interval=20 * 60,
+             window_start=time(8, 30), window_end=time(13, 0)),   # 8:30 AM - 1:00 PM CST
+    Provider('rapidapi', daily_limit=30, interval=20 * 60,
+             window_start=time(13, 10), window_end=time(22, 0)),  # 1:10 PM - 10:00 PM CST
+])
+
+# Set once load_data() has read the files above
+data_loaded = threading.Event()
+
+# Function to read the message corpus, symbols, caches and budgets and to
+# import the network stack. main() runs it in the background while the
+# opening animation plays, so none of it delays the first frame.
+def load_data():
+    if data_loaded.is_set():
+        return
+    reload_stock_symbols()
+    stock_cache.load()
+    price_history.open()
+    weather_cache.load()
+    api_budget.load()
+    message_corpus.load()
+    if stock_providers_configured() or weather_configured():
+        import requests  # noqa: F401 - warms the import for the first fetch
+    data_loaded.set()
+
+# Function to load the data files, then start a weather refresh if needed
+def start_up(fetcher):
+    load_data()
+    request_weather(fetcher)
+
+# Function to check if the weather API is configured
+def weather_configured():
+    return bool(OPENWEATHERMAP_API_KEY and CITY)
+
+# Function to check if a stock provider has an API key
+def stock_provider_configured(provider):
+    return bool({'alpha_vantage': ALPHA_VANTAGE_API_KEY, 'rapidapi': RAPIDAPI_KEY}.get(provider))
+
+# Function to check if any stock provider has an API key
+def stock_providers_configured():
+    return any(stock_provider_configured(provider) for provider in api_budget.providers)
+
+# Function to get the stock provider whose call window is open, if it has a key
+def active_stock_provider():
+    provider = api_budget.active_provider()
+    return provider if stock_provider_configured(provider) else None
+
+# Function to report which features are off because settings are missing
+def report_offline_features():
+    missing = [name for name, value in (('OPENWEATHERMAP_API_KEY', OPENWEATHERMAP_API_KEY),
+                                        ('ALPHA_VANTAGE_API_KEY', ALPHA_VANTAGE_API_KEY),
+                                        ('RAPIDAPI_KEY', RAPIDAPI_KEY),
+                                        ('CITY_NAME', CITY)) if not value]
+    if missing:
+        print(f"Missing environment variables: {', '.join(missing)}; running without the features that need them.")
+
+# Function to initialize the LCD display; symbols such as the degree sign
+# are loaded into CGRAM by the driver's glyph cache when first displayed
+def initialize_lcd(port=I2C_LCD_driver.I2CBUS, address=I2C_LCD_driver.ADDRESS, warm=False):
+    try:
+        return I2C_LCD_driver.lcd(address=address, port=port, warm=warm)
     except Exception as e:
         print(f"Error initializing LCD: {e}")
         sys.exit(1)
 
-# Function to fetch weather data from OpenWeatherMap API
+# Weather conditions drawn with a custom-character icon
+WEATHER_ICONS = {
+    'Clear': '☀',
+    'Clouds': '☁',
+    'Rain': '☂',
+    'Drizzle': '☂',
+    'Snow': '❄',
+    'Thunderstorm': '⚡',
+}
+
+# Function to format a quote for the LCD, with an up or down arrow for the change
+def format_quote(symbol, price, price_change):
+    arrow = '↑' if price_change >= 0 else '↓'
+    return f"{symbol}: {price:.2f} {arrow}{abs(price_change):.2f}"
+
+# Function to cache a fetched quote and add it to the symbol's price history
+def store_quote(symbol, price, price_change):
+    stock_info = format_quote(symbol, price, price_change)
+    stock_cache.put(symbol, stock_info, price, price_change)
+    price_history.record(symbol, price)
+    return stock_info
+
+# Function to format a temperature and weather condition for the LCD
+def format_weather(temperature, weather_main):
+    icon = WEATHER_ICONS.get(weather_main, '')
+    return f"{temperature}°F {icon}{weather_main}"
+
+# Function to fetch the current weather from OpenWeatherMap API into the cache
 def get_weather():
-    WEATHER_API_URL = f'http://api.openweathermap.org/data/2.5/weather?q={CITY}&appid={OPENWEATHERMAP_API_KEY}&units=imperial'
+    WEATHER_API_URL = f'{OPENWEATHERMAP_URL}?q={CITY}&appid={OPENWEATHERMAP_API_KEY}&units=imperial'
     try:
-        response = requests.get(WEATHER_API_URL)
-        response.raise_for_status()
-        data = response.json()
-        
+        data = api_client.get_json(WEATHER_API_URL)
+
         # Extract temperature and main weather condition
         temperature = int(data['main']['temp'])
         weather_main = data['weather'][0]['main']
-        
-        # Format weather information for display
-        weather = f"{temperature}\x00F {weather_main}"
-        return weather
-    except requests.RequestException as e:
+        weather_cache.put_observation(temperature, weather_main)
+        fetch_results.inc(provider='openweathermap', result='ok')
+        return True
+    except (ApiError, KeyError, IndexError, TypeError, ValueError) as e:
+        fetch_results.inc(provider='openweathermap', result='error')
+        weather_cache.failed()
         print(f"Error fetching weather data: {e}")
-        return "N/A"
+        return False
+
+# Function to fetch the next hours of 3-hourly forecast into the cache
+def get_weather_forecast():
+    FORECAST_API_URL = f'{OPENWEATHERMAP_FORECAST_URL}?q={CITY}&appid={OPENWEATHERMAP_API_KEY}&units=imperial&cnt={FORECAST_SLOTS}'
+    try:
+        data = api_client.get_json(FORECAST_API_URL)
+        slots = [(int(slot['dt']), int(slot['main']['temp']), slot['weather'][0]['main']) for slot in data['list']]
+        weather_cache.put_forecast(slots)
+        fetch_results.inc(provider='openweathermap_forecast', result='ok')
+        return True
+    except (ApiError, KeyError, IndexError, TypeError, ValueError) as e:
+        fetch_results.inc(provider='openweathermap_forecast', result='error')
+        weather_cache.failed()
+        print(f"Error fetching weather forecast: {e}")
+        return False
+
+# Function to refresh whatever part of the weather cache is out of date
+def refresh_weather():
+    if weather_cache.observation_due() and not get_weather():
+        return
+    if weather_cache.forecast_due():
+        get_weather_forecast()
+
+# Function to start a background weather refresh if the cache is out of date;
+# the screens keep showing the cached weather meanwhile
+def request_weather(fetcher):
+    if data_loaded.is_set() and weather_configured() and weather_cache.due():
+        fetcher.request('weather', refresh_weather)
 
-# Function to fetch stock data from Alpha Vantage API
+# Function to fetch stock data from Alpha Vantage API; returns the stored
+# quote, or None if the call failed (including the rate-limit "Note" reply)
 def get_stock_price_alpha_vantage(symbol):
-    STOCK_API_URL = f'https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&apikey={ALPHA_VANTAGE_API_KEY}'
+    STOCK_API_URL = f'{ALPHA_VANTAGE_URL}?function=GLOBAL_QUOTE&symbol={symbol}&apikey={ALPHA_VANTAGE_API_KEY}'
     try:
-        response = requests.get(STOCK_API_URL)
-        response.raise_for_status()
-        data = response.json()
+        data = api_client.get_json(STOCK_API_URL)
         if 'Global Quote' not in data:
             raise KeyError("Global Quote not found in response")
         global_quote = data['Global Quote']
         price = float(global_quote['05. price'])
         price_change = float(global_quote['09. change'])
-        stock_info = f"{symbol}: {price:.2f} {price_change:+.2f}"
-        return stock_info
-    except (requests.RequestException, KeyError) as e:
+        fetch_results.inc(provider='alpha_vantage', result='ok')
+        return store_quote(symbol, price, price_change)
+    except (ApiError, KeyError, TypeError, ValueError) as e:
+        fetch_results.inc(provider='alpha_vantage', result='error')
         print(f"Error fetching stock data: {e}")
-        return random.choice(positive_messages)
+        return None
 
-# Function to fetch stock data from RapidAPI with caching and rate limiting
-def get_stock_price_rapidapi(symbol):
-    now = datetime.now()
-    stock_cache = load_stock_cache()
-    
-    # Check if the stock data is in the cache and is still valid
-    if symbol in stock_cache and (now - datetime.fromisoformat(stock_cache[symbol]['timestamp'])).seconds < 1800:
-        return stock_cache[symbol]['stock_info']
+# Function to fetch quotes for several symbols in one Alpha Vantage call.
+# REALTIME_BULK_QUOTES needs a premium key; without ALPHA_VANTAGE_BULK the
+# call is spent on a single GLOBAL_QUOTE for the first symbol.
+def get_stock_prices_alpha_vantage(symbols):
+    if not ALPHA_VANTAGE_BULK:
+        symbol = symbols[0]
+        stock_info = get_stock_price_alpha_vantage(symbol)
+        return {symbol: stock_info} if stock_info is not None else {}
+
+    STOCK_API_URL = f'{ALPHA_VANTAGE_URL}?function=REALTIME_BULK_QUOTES&symbol={",".join(symbols)}&apikey={ALPHA_VANTAGE_API_KEY}'
+    quotes = {}
+    try:
+        data = api_client.get_json(STOCK_API_URL)
+        if 'data' not in data:
+            raise KeyError("data not found in bulk quote response")
+        for quote in data['data']:
+            try:
+                symbol = quote['symbol']
+                price = float(quote['close'])
+                price_change = float(quote['change'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            quotes[symbol] = store_quote(symbol, price, price_change)
+    except (ApiError, KeyError, TypeError) as e:
+        fetch_results.inc(provider='alpha_vantage', result='error')
+        print(f"Error fetching bulk stock data: {e}")
+        return quotes
+    # a reply without a usable quote (a throttling note, a schema change)
+    # is counted apart from one that brought quotes back
+    fetch_results.inc(provider='alpha_vantage', result='ok' if quotes else 'empty')
+    if not quotes:
+        print("No quotes in bulk stock data")
+    return quotes
 
-    url = f"https://yahoo-finance127.p.rapidapi.com/price/{symbol}"
+# Function to fetch quotes for several symbols in one RapidAPI call
+def get_stock_prices_rapidapi(symbols):
+    url = f"{RAPIDAPI_URL}/multi-quote/{','.join(symbols)}"
     headers = {
         "X-RapidAPI-Key": RAPIDAPI_KEY,
-        "X-RapidAPI-Host": "yahoo-finance127.p.rapidapi.com"
+        "X-RapidAPI-Host": RAPIDAPI_HOST
     }
+    quotes = {}
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        price = data['regularMarketPrice']['raw']
-        price_change = data['regularMarketChange']['raw']
-        stock_info = f"{symbol}: {price:.2f} {price_change:+.2f}"
-        
-        # Cache the stock data
-        stock_cache[symbol] = {
-            'stock_info': stock_info,
-            'timestamp': now.isoformat()
-        }
-        save_stock_cache(stock_cache)
-        
-        return stock_info
-    except (requests.RequestException, KeyError) as e:
+        data = api_client.get_json(url, headers=headers)
+        for symbol in symbols:
+            try:
+                price = float(data[symbol]['regularMarketPrice']['raw'])
+                price_change = float(data[symbol]['regularMarketChange']['raw'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            quotes[symbol] = store_quote(symbol, price, price_change)
+    except ApiError as e:
+        fetch_results.inc(provider='rapidapi', result='error')
         print(f"Error fetching stock data from RapidAPI: {e}")
-        return random.choice(positive_messages)
+        return quotes
+    fetch_results.inc(provider='rapidapi', result='ok' if quotes else 'empty')
+    if not quotes:
+        print("No quotes in RapidAPI stock data")
+    return quotes
 
-# Function to load stock cache from a file
-def load_stock_cache():
-    try:
-        if os.path.exists(STOCK_CACHE_FILE):
-            with open(STOCK_CACHE_FILE, 'r') as file:
-                return json.load(file)
-        else:
-            return {}
-    except Exception as e:
-        print(f"Error loading stock cache: {e}")
-        return {}
+# Function to fetch a batch of quotes and return the symbol to display, or
+# None if the call brought nothing back
+def fetch_stock_batch(fetch_batch, symbols):
+    quotes = fetch_batch(symbols)
+    if not quotes:
+        return None
+    return symbols[0] if symbols[0] in quotes else random.choice(list(quotes))
 
-# Function to save stock cache to a file
-def save_stock_cache(cache):
-    try:
-        with open(STOCK_CACHE_FILE, 'w') as file:
-            json.dump(cache, file)
-    except Exception as e:
-        print(f"Error saving stock cache: {e}")
+# Batch fetcher and symbols per call for each budgeted provider
+STOCK_PROVIDERS = {
+    'alpha_vantage': (get_stock_prices_alpha_vantage, ALPHA_VANTAGE_BATCH_SIZE),
+    'rapidapi': (get_stock_prices_rapidapi, RAPIDAPI_BATCH_SIZE),
+}
+
+# Function to get a random watchlist symbol with a fresh cached quote, if any
+def get_cached_stock():
+    fresh = stock_cache.fresh(stock_symbols)
+    if not fresh:
+        return None
+    return random.choice(fresh)
 
-# Function to display the date on the LCD
-def display_date(lcd):
+# Function to build the date screen
+def date_screen():
     now = datetime.now()
     month_abbr = now.strftime("%b")
     date_str = f"{month_abbr} {now.day}, {now.year}"
-    
-    for _ in range(30):
-        now = datetime.now()
-        time_str = now.strftime("%I:%M:%S %p")
-
-        print(date_str.center(16))
-        print(time_str.center(16))
-
-        lcd.lcd_clear()
-        lcd.lcd_display_string(date_str.center(16), 1)
-        lcd.lcd_display_string(time_str.center(16), 2)
-
-        log_to_file(date_str, time_str)
-
-        sleep(1)
-
-# Function to display stock information on the LCD
-def display_stock(lcd, stock_str):
-    for _ in range(30):  # Display for 30 seconds
-        now = datetime.now()
-        time_str = now.strftime("%I:%M:%S %p")
+    return clock_screen('date', PLAYLIST['date'], date_str)
 
-        print(stock_str.center(16))
-        print(time_str.center(16))
+# Function to build the stock screen
+def stock_screen(stock_str):
+    return clock_screen('stock', PLAYLIST['stock'], stock_str)
 
-        lcd.lcd_clear()
-        lcd.lcd_display_string(stock_str.center(16), 1)
-        lcd.lcd_display_string(time_str.center(16), 2)
+# Function to build the weather screen from the cached weather. A forecast
+# standing in for an expired observation is marked with "~"; with nothing
+# cached at all the screen is skipped.
+def weather_screen(fetcher):
+    if not weather_configured():
+        return None
+    request_weather(fetcher)
+    weather = weather_cache.current()
+    if weather is None:
+        return None
+    temperature, weather_main, estimated = weather
+    weather_str = ('~' if estimated else '') + format_weather(temperature, weather_main)
+    return clock_screen('weather', PLAYLIST['weather'], weather_str)
 
-        log_to_file(stock_str, time_str)
+# Function to build a screen with the next two forecast slots, from memory
+def forecast_screen():
+    if not weather_configured():
+        return None
+    slots = weather_cache.upcoming(2)
+    if not slots:
+        return None
+    rows = [f"{datetime.fromtimestamp(slot['time']).strftime('%I%p').lstrip('0')} {slot['temp']}° "
+            f"{WEATHER_ICONS.get(slot['condition'], '')}{slot['condition']}" for slot in slots]
+    rows += [''] * (2 - len(rows))
+    return two_line_screen('forecast', PLAYLIST['forecast'], rows[0], rows[1],
+                           log_text=' | '.join(row for row in rows if row))
 
-        sleep(1)
+# Function to build a positive or wellness message screen
+def message_screen(message):
+    return clock_screen('message', PLAYLIST['message'], message)
 
-# Function to display weather information on the LCD
-def display_weather(lcd, weather_str):
-    for _ in range(15):
-        now = datetime.now()
-        time_str = now.strftime("%I:%M:%S %p")
+# Function to build a screen for a message that needs both rows
+def message_pair_screen(frame):
+    phase = 'historical' if frame.pool == 'historical' else 'message'
+    return two_line_screen(phase, PLAYLIST[phase], frame.line1, frame.line2,
+                           log_text=f"{frame.line1.strip()} | {frame.line2.strip()}")
 
-        print(weather_str.center(16))
-        print(time_str.center(16))
+# Function to start the next stock batch fetch if the budget allows, so the
+# quote is ready by the time the feature screen comes up. Nothing is spent
+# until load_data() has restored the budget and the cache.
+def request_stock_batch(fetcher):
+    if not data_loaded.is_set():
+        return None
+    provider = active_stock_provider()
+    if provider is not None and not fetcher.pending('stock') and api_budget.ready(provider):
+        fetch_batch, batch_size = STOCK_PROVIDERS[provider]
+        batch = pick_symbols(stock_symbols, stock_cache.age, batch_size, STOCK_REFRESH_AGE)
+        if batch and api_budget.spend(provider):
+            fetcher.request('stock', fetch_stock_batch, fetch_batch, batch)
+    return None
 
-        lcd.lcd_clear()
-        lcd.lcd_display_string(weather_str.center(16), 1)
-        lcd.lcd_display_string(time_str.center(16), 2)
+# Symbol of the quote on the last stock screen, for the sparkline that follows it
+last_stock_symbol = None
 
-        log_to_file(weather_str, time_str)
+# Function to build an intraday sparkline screen for the stock just shown
+def sparkline_screen():
+    global last_stock_symbol
+    symbol, last_stock_symbol = last_stock_symbol, None
+    if symbol is None:
+        return None
+    midnight = datetime.combine(datetime.now().date(), time()).timestamp()
+    prices = [price for _, price in price_history.series(symbol, since=midnight)]
+    if len(prices) < 2:
+        return None
+    entry = stock_cache.peek(symbol)
+    title = f"{symbol} {prices[-1]:.2f}"
+    if entry and entry['change'] is not None and len(title) + 6 <= 16:
+        title += f" {entry['change']:+.2f}"
+    return two_line_screen('sparkline', PLAYLIST['sparkline'], title, sparkline(prices, 16),
+                           log_text=f"{title} | {len(prices)} points")
 
-        sleep(1)
+# Function to build the screen shown after the date: a stock quote when one is
+# ready, otherwise a message weighted by the size of each message file
+def feature_screen(fetcher):
+    within_stock_hours = active_stock_provider() is not None
 
-# Function to display positive or wellness messages on the LCD
-def display_message(lcd, message):
-    for _ in range(25):  # Display for 25 seconds
-        now = datetime.now()
-        time_str = now.strftime("%I:%M:%S %p")
+    # A quote still in flight is shown on the next cycle instead of waiting;
+    # between calls, quotes fetched by earlier batches are shown from memory
+    global last_stock_symbol
+    symbol = fetcher.take('stock')
+    if symbol is None and within_stock_hours:
+        symbol = get_cached_stock()
+    entry = stock_cache.peek(symbol) if symbol else None
+    if entry is not None:
+        last_stock_symbol = symbol
+        return stock_screen(entry['stock_info'])
 
-        print(message.center(16))
-        print(time_str.center(16))
+    if within_stock_hours:
+        return pick_message_screen(['positive', 'wellness'])
+    return pick_message_screen(['positive', 'wellness', 'historical'])
 
-        lcd.lcd_clear()
-        lcd.lcd_display_string(message.center(16), 1)
-        lcd.lcd_display_string(time_str.center(16), 2)
+# Function to build a screen for the next message from the given pools
+def pick_message_screen(pools):
+    frame = message_corpus.pick(pools)
+    if frame is None:
+        return None
+    if frame.two_line:
+        return message_pair_screen(frame)
+    return message_screen(frame.line1)
 
-        log_to_file(message, time_str)
+# Messages pushed through the control API, shown ahead of the playlist
+priority_messages = deque(maxlen=MAX_PRIORITY_MESSAGES)
 
-        sleep(1)
+# Function to queue a priority message and cut the current screen short; a
+# literal "\n" splits the two rows. Safe to call from any thread.
+def push_message(text, duration=PRIORITY_MESSAGE_DURATION):
+    frame = layout('priority', text, parse_line(text))
+    if frame is None:
+        raise ValueError("message is too long to display")
+    priority_messages.append((frame, duration))
+    power.wake()  # also ends the idle screen during quiet hours
+    frame_scheduler.preempt.set()
 
-# Function to display historical messages on the LCD
-def display_historical_message(lcd, message):
-    lines = message.split('\n')
-    if len(lines) == 2:
-        line1, line2 = lines
-        for _ in range(25):  # Display for 25 seconds
-            now = datetime.now()
-            time_str = now.strftime("%I:%M:%S %p")
+# Function to build the screen for the next pushed message, if any
+def priority_screen():
+    try:
+        frame, duration = priority_messages.popleft()
+    except IndexError:
+        return None
+    if frame.two_line:
+        return two_line_screen('priority', duration, frame.line1, frame.line2,
+                               log_text=f"{frame.line1.strip()} | {frame.line2.strip()}")
+    return clock_screen('priority', duration, frame.line1)
 
-            print(f"Displaying historical message: {line1} | {line2}")  # Debug: Print message being displayed
+# Shared writer thread for the event log
+log_writer = None
 
-            lcd.lcd_clear()
-            lcd.lcd_display_string(line1.center(16), 1)
-            lcd.lcd_display_string(line2.center(16), 2)
+# Function to get the log writer, starting its thread on first use
+def get_log_writer():
+    global log_writer
+    if log_writer is None:
+        sink = EventLog(LOG_DIR, max_bytes=LOG_SEGMENT_BYTES, max_age=LOG_SEGMENT_AGE,
+                        retention_days=LOG_RETENTION_DAYS, flush_interval=LOG_FLUSH_INTERVAL)
+        log_writer = AsyncLogWriter(sink, LOG_QUEUE_SIZE)
+    return log_writer
 
-            log_to_file(f"{line1} | {line2}", time_str)
+# Function to close the log writer so the log files can be removed
+def close_log_writer():
+    global log_writer
+    if log_writer is not None:
+        log_writer.close()
+        log_writer = None
 
-            sleep(1)
-    else:
-        print(f"Invalid historical message format: {message}")
+# Write out queued log entries when the program exits
+atexit.register(close_log_writer)
 
 # Function to log displayed information to a file
 def log_to_file(line1, line2):
     try:
-        # Log to text file
-        with open(LOG_FILE, 'a') as log_file:
-            log_file.write(f"{datetime.now()}: {line1} | {line2}\n")
-        
-        # Log to HTML file
-        ensure_html_format()
-        
-        log_entry = f"<div class='log-entry'><strong>{datetime.now()}</strong>: {line1} | {line2}</div>\n"
-        
-        with open(HTML_LOG_FILE, 'r') as html_file:
-            content = html_file.read()
-        
-        new_content = content.replace("</div></body></html>", log_entry + "</div></body></html>")
-        
-        with open(HTML_LOG_FILE, 'w') as html_file:
-            html_file.write(new_content)
-        
+        get_log_writer().write(line1, line2)
     except Exception as e:
         print(f"Error logging to file: {e}")
 
-# Function to ensure the HTML file has a proper structure
-def ensure_html_format():
-    now = datetime.now()
-    created_date = now.strftime("%B %d, %Y | %I:%M %p")
-    
-    if not os.path.exists(HTML_LOG_FILE):
-        with open(HTML_LOG_FILE, 'w') as html_file:
-            with open('style_log_template.html', 'r') as template_file:
-                template = template_file.read()
-            html_content = template.replace("{created_date}", created_date).replace("{log_entries}", "")
-            html_file.write(html_content)
-    else:
-        with open(HTML_LOG_FILE, 'r') as html_file:
-            content = html_file.read()
-        if not content.startswith("<!DOCTYPE html>"):
-            with open(HTML_LOG_FILE, 'w') as html_file:
-                with open('style_log_template.html', 'r') as template_file:
-                    template = template_file.read()
-                html_content = template.replace("{created_date}", created_date).replace("{log_entries}", "")
-                html_file.write(html_content)
-        if not content.endswith("</div></body></html>"):
-            with open(HTML_LOG_FILE, 'a') as html_file:
-                html_file.write("</div></body></html>\n")
-
-
-# Function to check if current time is within Alpha Vantage API call hours
-def is_within_alpha_vantage_hours():
-    now = datetime.now().time()
-    start_time = time(8, 30)  # 8:30 AM CST
-    end_time = time(13, 0)    # 1:00 PM CST
-    return start_time <= now <= end_time
-
-# Function to check if current time is within RapidAPI call hours
-def is_within_rapidapi_hours():
-    now = datetime.now().time()
-    start_time = time(13, 10)  # 1:10 PM CST
-    end_time = time(22, 0)     # 10:00 PM CST
-    return start_time <= now <= end_time
-
-# Function to delete the log file every two days at 2 AM CST
-def delete_log_file():
-    now = datetime.now()
-    if os.path.exists(LAST_DELETION_FILE):
-        with open(LAST_DELETION_FILE, 'r') as file:
-            last_deletion_date = datetime.fromisoformat(file.read().strip())
-    else:
-        last_deletion_date = now - timedelta(days=3)  # Set to more than 2 days ago initially
-
-    # Check if it's 2 AM CST and more than two days have passed since the last deletion
-    if now.time() >= time(2, 0) and (now - last_deletion_date).days >= 2:
-        try:
-            if os.path.exists(LOG_FILE):
-                os.remove(LOG_FILE)
-                print("Log file deleted.")
-            if os.path.exists(HTML_LOG_FILE):
-                os.remove(HTML_LOG_FILE)
-                print("HTML log file deleted.")
-
-            with open(LAST_DELETION_FILE, 'w') as file:
-                file.write(now.isoformat())
-
-        except Exception as e:
-            print(f"Error deleting log file: {e}")
-
 # Function to display the opening message
 def display_opening_message(lcd):
     message_line1 = "Signally"
@@ -365,9 +620,10 @@ def display_opening_message(lcd):
 
     # Swipe in from the right to the center
     for i in range(total_length, (total_length - len(message_line1)) // 2, -1):
-        lcd.lcd_clear()
-        lcd.lcd_display_string(message_line1.rjust(i + len(message_line1)), 1)
-        lcd.lcd_display_string(message_line2.rjust(i + len(message_line2)), 2)
+        lcd.lcd_buffer_clear()
+        lcd.lcd_buffer_string(message_line1.rjust(i + len(message_line1)), 1)
+        lcd.lcd_buffer_string(message_line2.rjust(i + len(message_line2)), 2)
+        lcd.lcd_flush()
         sleep(0.1)
 
     # Stay for 5 seconds
@@ -375,67 +631,398 @@ def display_opening_message(lcd):
 
     # Simulate fade out by replacing characters with spaces, keeping text centered
     for i in range(len(message_line1)):
-        lcd.lcd_clear()
+        lcd.lcd_buffer_clear()
         fade_line1 = message_line1[:len(message_line1) - i].ljust(len(message_line1))
         fade_line2 = message_line2[:len(message_line2) - i].ljust(len(message_line2))
-        lcd.lcd_display_string(fade_line1.center(total_length), 1)
-        lcd.lcd_display_string(fade_line2.center(total_length), 2)
+        lcd.lcd_buffer_string(fade_line1.center(total_length), 1)
+        lcd.lcd_buffer_string(fade_line2.center(total_length), 2)
+        lcd.lcd_flush()
         sleep(0.1)
 
+# Function to read the counters the components already keep, on each scrape
+def collect_metrics(lcd):
+    device = lcd.lcd_device
+    scheduler = frame_scheduler.stats()
+    cache = stock_cache.stats()
+    collected = [
+        Snapshot('counter', 'signally_i2c_bytes_total', 'Bytes written to the LCD over I2C', [({}, device.bytes_written)]),
+        Snapshot('counter', 'signally_i2c_transactions_total', 'I2C write transactions', [({}, device.transactions)]),
+        Snapshot('counter', 'signally_i2c_busy_seconds_total', 'Time spent in I2C writes', [({}, device.busy_time)]),
+        Snapshot('counter', 'signally_i2c_reconnects_total', 'I2C bus reconnects after a write error',
+                 [({}, getattr(device, 'reconnects', 0))]),
+        Snapshot('counter', 'signally_display_restarts_total', 'Display loop restarts after a failure',
+                 [({}, supervisor.restarts)]),
+        Snapshot('counter', 'signally_glyph_uploads_total', 'Custom characters written to CGRAM', [({}, lcd.glyphs.uploads)]),
+        Snapshot('counter', 'signally_frames_total', 'Frames rendered', [({}, scheduler['frames'])]),
+        Snapshot('counter', 'signally_frames_missed_total', 'Ticks skipped because a frame ran late', [({}, scheduler['missed'])]),
+        Snapshot('gauge', 'signally_frame_jitter_max_seconds', 'Largest delay past a frame deadline', [({}, scheduler['max_jitter'])]),
+        Snapshot('counter', 'signally_quote_cache_hits_total', 'Quote cache lookups served from memory', [({}, cache['hits'])]),
+        Snapshot('counter', 'signally_quote_cache_misses_total', 'Quote cache lookups that missed', [({}, cache['misses'])]),
+        Snapshot('gauge', 'signally_quote_cache_hit_ratio', 'Share of quote cache lookups that hit', [({}, cache['hit_ratio'])]),
+    ]
+
+    hosts = api_client.stats()
+    collected.append(Snapshot('histogram', 'signally_api_latency_seconds', 'API call latency per host',
+                              [({'host': host}, (list(stats['buckets']), list(stats['buckets'].values()), stats['mean'] * stats['count']))
+                               for host, stats in hosts.items()]))
+    collected.append(Snapshot('counter', 'signally_api_errors_total', 'API calls that failed at the HTTP level',
+                              [({'host': host}, stats['errors']) for host, stats in hosts.items()]))
+
+    budget = api_budget.remaining()
+    collected.append(Snapshot('gauge', 'signally_api_calls_remaining', 'Calls left in the daily budget',
+                              [({'provider': name}, left['remaining_today']) for name, left in budget.items()]))
+
+    weather_age = weather_cache.age()
+    if weather_age is not None:
+        collected.append(Snapshot('gauge', 'signally_weather_age_seconds', 'Age of the cached weather observation',
+                                  [({}, weather_age)]))
+
+    writer = log_writer
+    if writer is not None:
+        stats = writer.stats()
+        collected += [
+            Snapshot('gauge', 'signally_log_queue_depth', 'Log entries waiting for the writer thread', [({}, stats['queue_depth'])]),
+            Snapshot('gauge', 'signally_log_lag_seconds', 'Age of the oldest entry in the last written batch', [({}, stats['last_lag'])]),
+            Snapshot('counter', 'signally_log_dropped_total', 'Log entries dropped because the queue was full', [({}, stats['dropped'])]),
+        ]
+    return collected
+
+# Function to serve the metrics endpoint, if enabled
+def start_metrics_server():
+    if not METRICS_PORT:
+        return None
+    server = MetricsServer(metrics.registry, METRICS_HOST, int(METRICS_PORT))
+    try:
+        server.start()
+    except OSError as e:
+        print(f"Error starting metrics server: {e}")
+        return None
+    return server
+
+# Playlist of the main display, for the control API's state query
+active_playlist = None
+
+# Function to read what the main display is showing. Glyph slot codes on the
+# glass are mapped back to the symbols they hold.
+def display_state(lcd):
+    playlist = active_playlist
+    screen = playlist.current if playlist is not None else None
+    symbols = {chr(slot): char for char, slot in list(lcd.glyphs.resident.items())}
+    return {
+        'screen': getattr(screen, 'name', None),
+        'text': getattr(screen, 'log_text', None),
+        'position': playlist.position if playlist is not None else None,
+        'glass': [''.join(symbols.get(char, char) for char in list(row)) for row in lcd.shadow],
+        'display_on': lcd.display_on,
+        'quiet': power.is_quiet(),
+        'queued_messages': len(priority_messages),
+        'data_loaded': data_loaded.is_set(),
+        'symbols': len(stock_symbols),
+        'scheduler': frame_scheduler.stats(),
+    }
+
+# Function to change settings while running: provider call windows and daily
+# limits, and quiet hours. Changes last until the next restart.
+def apply_config(config):
+    if not isinstance(config, dict):
+        raise TypeError("config must be a JSON object")
+    providers = config.get('providers', {})
+    if not isinstance(providers, dict):
+        raise TypeError("providers must be a JSON object")
+    for name, settings in providers.items():
+        if name not in api_budget.providers:
+            raise ValueError(f"unknown provider {name!r}")
+        if not isinstance(settings, dict):
+            raise TypeError(f"settings for {name!r} must be a JSON object")
+    changes = []
+    for name, settings in providers.items():
+        start = settings.get('window_start')
+        end = settings.get('window_end')
+        limit = settings.get('daily_limit')
+        start = datetime.strptime(start, '%H:%M').time() if start else None
+        end = datetime.strptime(end, '%H:%M').time() if end else None
+        limit = int(limit) if limit is not None else None
+        changes.append((api_budget.providers[name], start, end, limit))
+    if not isinstance(config.get('quiet_hours', ''), str):
+        raise TypeError("quiet_hours must be a string")
+    quiet_hours = parse_quiet_hours(config['quiet_hours']) if 'quiet_hours' in config else power.quiet_hours
+    quiet_mode = config.get('quiet_mode', power.mode)
+    if quiet_mode not in (QUIET_OFF, QUIET_CLOCK):
+        raise ValueError(f"quiet_mode must be {QUIET_OFF!r} or {QUIET_CLOCK!r}")
+
+    # everything is validated before anything is changed
+    with api_budget.lock:
+        for provider, start, end, limit in changes:
+            provider.window_start = start or provider.window_start
+            provider.window_end = end or provider.window_end
+            provider.daily_limit = limit if limit is not None else provider.daily_limit
+    power.quiet_hours = quiet_hours
+    power.mode = quiet_mode
+    power.wake_event.set()  # the idle screen rechecks the schedule
+
+# Handlers for the control API; each takes the JSON body and returns
+# (status, body). They run on the control server's worker threads.
+def control_routes(lcd):
+    def message(body):
+        if not isinstance(body, dict):
+            return 400, {'error': 'body must be a JSON object'}
+        text = str(body.get('text', '')).strip()
+        if not text:
+            return 400, {'error': 'text is required'}
+        try:
+            duration = int(body.get('duration', PRIORITY_MESSAGE_DURATION))
+            push_message(text, max(duration, 1))
+        except (TypeError, ValueError) as e:
+            return 400, {'error': str(e)}
+        return 200, {'queued': len(priority_messages)}
+
+    def reload(body):
+        symbols = reload_stock_symbols()
+        changed = message_corpus.refresh(force=True)
+        return 200, {'symbols': len(symbols), 'messages_changed': changed,
+                     'messages': {pool: message_corpus.count(pool) for pool in message_corpus.files}}
+
+    def current_config():
+        return {
+            'providers': {name: {'window_start': provider.window_start.strftime('%H:%M'),
+                                 'window_end': provider.window_end.strftime('%H:%M'),
+                                 'daily_limit': provider.daily_limit}
+                          for name, provider in api_budget.providers.items()},
+            'quiet_hours': '-'.join(t.strftime('%H:%M') for t in power.quiet_hours) if power.quiet_hours else '',
+            'quiet_mode': power.mode,
+        }
+
+    def config(body):
+        try:
+            apply_config(body)
+        except (ValueError, TypeError) as e:
+            return 400, {'error': str(e)}
+        return 200, current_config()
+
+    return {
+        ('POST', '/message'): message,
+        ('POST', '/reload'): reload,
+        ('POST', '/config'): config,
+        ('GET', '/config'): lambda body: (200, current_config()),
+        ('GET', '/state'): lambda body: (200, display_state(lcd)),
+        ('GET', '/metrics'): lambda body: (200, metrics.registry.render()),
+    }
+
+# Function to serve the control API, if enabled
+def start_control_server(lcd):
+    if not CONTROL_PORT:
+        return None
+    server = ControlServer(control_routes(lcd), CONTROL_HOST, int(CONTROL_PORT))
+    try:
+        server.start()
+    except OSError as e:
+        print(f"Error starting control server: {e}")
+        return None
+    return server
+
 # Main function that runs the display loop
 def main():
-    lcd = initialize_lcd()
-    display_opening_message(lcd)
-
-    alpha_vantage_call_count = 0
-    rapidapi_call_count = 0
-    max_alpha_vantage_calls = 25
-    max_rapidapi_calls = 30
-    alpha_vantage_interval = 20 * 60  # 20 minutes in seconds
-    rapidapi_interval = 20 * 60  # 20 minutes in seconds
-    last_alpha_vantage_call_time = None
-    last_rapidapi_call_time = None
-
-    while True:
-        current_time = datetime.now()
-        display_date(lcd)
-
-        # Reset API call counts at midnight
-        if current_time.hour == 0 and current_time.minute == 0:
-            alpha_vantage_call_count = 0
-            rapidapi_call_count = 0
-
-        if is_within_alpha_vantage_hours() and alpha_vantage_call_count < max_alpha_vantage_calls:
-            if last_alpha_vantage_call_time is None or (current_time - last_alpha_vantage_call_time).seconds >= alpha_vantage_interval:
-                stock_symbol = random.choice(stock_symbols)
-                stock_str = get_stock_price_alpha_vantage(stock_symbol)
-                alpha_vantage_call_count += 1
-                last_alpha_vantage_call_time = current_time
-                display_stock(lcd, stock_str)
-            else:
-                message = random.choice(positive_messages + wellness_messages)
-                display_message(lcd, message)
-        elif is_within_rapidapi_hours() and rapidapi_call_count < max_rapidapi_calls:
-            if last_rapidapi_call_time is None or (current_time - last_rapidapi_call_time).seconds >= rapidapi_interval:
-                stock_symbol = random.choice(stock_symbols)
-                stock_str = get_stock_price_rapidapi(stock_symbol)
-                rapidapi_call_count += 1
-                last_rapidapi_call_time = current_time
-                display_stock(lcd, stock_str)
-            else:
-                message = random.choice(positive_messages + wellness_messages)
-                display_message(lcd, message)
+    fetcher = FetchScheduler(max_workers=FETCH_WORKERS)
+
+    # A recent snapshot means this is a restart: the LCDs still show the last
+    # screen, so they are not cleared and the opening animation is skipped
+    snapshot = state_snapshot.load()
+    warm = snapshot is not None
+
+    # Bring the LCDs up first; files and the network stack load behind the
+    # opening animation
+    panels = parse_panels(LCD_PANELS)
+    manager = None
+    if len(panels) > 1:
+        manager = build_display_manager(panels, fetcher, warm)
+        # metrics and the control API describe the panel showing the main
+        # playlist (the one on the shared frame scheduler), wherever it is listed
+        lcd = next((panel.lcd for panel in manager.panels if panel.scheduler is frame_scheduler),
+                   manager.panels[0].lcd)
+    elif panels:
+        lcd = initialize_lcd(*panels[0][1:], warm=warm)
+    else:
+        lcd = initialize_lcd(warm=warm)
+    report_offline_features()
+    metrics.registry.register(lambda: collect_metrics(lcd))
+    metrics_server = start_metrics_server()
+    control_server = start_control_server(lcd)
+
+    wake_sources = start_wake_sources()
+
+    # Weather is refreshed right after the load if the saved observation is
+    # out of date, so it is ready before the opening animation ends
+    fetcher.request('startup', start_up, fetcher)
+
+    watchdog = None
+    try:
+        if manager is not None:
+            restore_snapshot(snapshot)
+            watchdog = start_watchdog([(panel.name, panel.scheduler) for panel in manager.panels])
+            manager.run()
         else:
-            message = random.choice(positive_messages + wellness_messages + historical_messages)
-            print(f"Selected message: {message}")  # Debug: Print selected message
-            if message in historical_messages:
-                display_historical_message(lcd, message)
-            else:
-                display_message(lcd, message)
-
-        weather_str = get_weather()
-        display_weather(lcd, weather_str)
-        delete_log_file()
+            if not warm:
+                display_opening_message(lcd)
+            watchdog = start_watchdog([('main', frame_scheduler)])
+            run_display_loop(lcd, fetcher, snapshot)
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+        save_snapshot(force=True)
+        fetcher.stop()
+        for source in wake_sources:
+            source.stop()
+        if manager is not None:
+            manager.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if control_server is not None:
+            control_server.stop()
+
+# Function to run the display cycle forever. After a failure the screen that
+# raised is skipped and the LCD resynced before the cycle carries on.
+def run_display_loop(lcd, fetcher, snapshot=None):
+    global active_playlist
+    active_playlist = main_playlist(fetcher)
+    restore_snapshot(snapshot)
+
+    def restart(error):
+        active_playlist.position = (active_playlist.position + 1) % len(active_playlist.entries)
+        try:
+            lcd.lcd_resync()
+        except OSError as e:
+            print(f"Error resyncing LCD: {e}")
+    supervisor.run(lambda: active_playlist.run(lcd, frame_scheduler, log_to_file), restart)
+
+# Function to read the state a warm restart resumes from
+def runtime_state():
+    playlist = active_playlist
+    current = playlist.current if playlist is not None else None
+    return {
+        'position': playlist.position if playlist is not None else 0,
+        'screen': getattr(current, 'name', None),
+        'last_stock_symbol': last_stock_symbol,
+    }
+
+# Function to save the state snapshot if it changed, or always when forced
+def save_snapshot(force=False):
+    state_snapshot.save(runtime_state(), force)
+
+# Function to resume the main playlist from a snapshot
+def restore_snapshot(snapshot):
+    global last_stock_symbol
+    if not snapshot or active_playlist is None:
+        return
+    position = snapshot.get('position')
+    if isinstance(position, int) and 0 <= position < len(active_playlist.entries):
+        active_playlist.position = position
+    if isinstance(snapshot.get('last_stock_symbol'), str):
+        last_stock_symbol = snapshot['last_stock_symbol']
+    print(f"Resuming at playlist position {active_playlist.position} ({snapshot.get('screen')})")
+
+# Function to save the snapshot and exit when a display loop stops rendering;
+# the stuck thread can't be recovered, so the service manager restarts us
+def on_stall(name, seconds):
+    save_snapshot(force=True)
+    stock_cache.flush()
+    weather_cache.save()
+    exit_stalled(name, seconds)
+
+# Function to start the watchdog over the given (name, frame scheduler) pairs,
+# if enabled. It also saves the state snapshot on every check.
+def start_watchdog(schedulers):
+    if not WATCHDOG_TIMEOUT:
+        return None
+    watchdog = Watchdog(float(WATCHDOG_TIMEOUT), WATCHDOG_INTERVAL, on_tick=save_snapshot, on_stall=on_stall)
+    for name, scheduler in schedulers:
+        watchdog.watch(name, scheduler)
+    watchdog.start()
+    return watchdog
+
+# Function to build the idle screen while quiet hours are on, else None
+def quiet_screen(fetcher=None):
+    if not power.is_quiet():
+        return None
+    return IdleScreen(power, fetcher)
+
+# Function to start the configured wake sources
+def start_wake_sources():
+    sources = []
+    if WAKE_SOCKET:
+        sources.append(SocketWake(power, WAKE_SOCKET))
+    if WAKE_GPIO_PIN:
+        sources.append(GpioWake(power, int(WAKE_GPIO_PIN)))
+    started = []
+    for source in sources:
+        try:
+            source.start()
+            started.append(source)
+        except (ImportError, OSError, ValueError) as e:
+            print(f"Error starting wake source {type(source).__name__}: {e}")
+    return started
+
+# Function to build the full display cycle
+def main_playlist(fetcher):
+    return Playlist([
+        lambda: quiet_screen(fetcher),
+        lambda: request_stock_batch(fetcher),
+        date_screen,
+        lambda: feature_screen(fetcher),
+        sparkline_screen,
+        lambda: weather_screen(fetcher),
+        forecast_screen,
+    ], priority=priority_screen)
+
+# Function to build the display cycle for a panel's content
+def panel_playlist(content, fetcher):
+    if content == 'clock':
+        return Playlist([quiet_screen, date_screen])
+    if content == 'weather':
+        return Playlist([quiet_screen, lambda: weather_screen(fetcher) or date_screen(), forecast_screen])
+    if content == 'messages':
+        return Playlist([quiet_screen, lambda: pick_message_screen(['positive', 'wellness', 'historical']) or date_screen()])
+    return main_playlist(fetcher)
+
+# Function to parse LCD_PANELS into (content, bus, address) tuples
+def parse_panels(spec):
+    panels = []
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            content, _, location = entry.partition('@')
+            port, _, address = location.partition(':')
+            port = int(port) if port else I2C_LCD_driver.I2CBUS
+            address = int(address, 0) if address else I2C_LCD_driver.ADDRESS
+        except ValueError:
+            print(f"Ignoring LCD panel {entry!r}: expected content@bus:address")
+            continue
+        if content not in PANEL_CONTENT:
+            print(f"Ignoring LCD panel {entry!r}: content must be one of {', '.join(PANEL_CONTENT)}")
+            continue
+        panels.append((content, port, address))
+    return panels
+
+# Function to set up one display thread per panel and one writer per I2C bus
+# The first main panel takes pushed messages and uses the shared frame
+# scheduler, so the control API can preempt it and report on it.
+def build_display_manager(panels, fetcher, warm=False):
+    global active_playlist
+    manager = DisplayManager()
+    for content, port, address in panels:
+        playlist = panel_playlist(content, fetcher)
+        log = log_to_file if content == 'main' else None
+        scheduler = None
+        if content == 'main' and active_playlist is None:
+            active_playlist = playlist
+            scheduler = frame_scheduler
+
+        # The opening animation only plays before the first screen, not when
+        # the panel's loop is restarted after a failure
+        def play(lcd, scheduler, playlist=playlist, log=log):
+            if not warm and playlist.current is None:
+                display_opening_message(lcd)
+            playlist.run(lcd, scheduler, log)
+        manager.add_panel(f"{content}@{port}:0x{address:02x}", play, address, port, scheduler=scheduler, warm=warm)
+    return manager
 
 
 # Entry point of the program
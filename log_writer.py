@@ -0,0 +1,98 @@
+# Signally LCD / background log writer
+#
+# Runs a log sink (event_log.EventLog) on its own thread behind a bounded
+# queue, so the display loop only pays for an enqueue.
+import threading
+from collections import deque
+from datetime import datetime
+from time import monotonic
+
+# The sink needs write(line1, line2, timestamp), flush(), close() and a
+# flush_interval. When the queue is full, an entry for the same screen as the
+# newest queued one replaces it (coalesced); otherwise the oldest queued entry
+# is dropped.
+class AsyncLogWriter:
+    def __init__(self, sink, max_queue=256):
+        self.sink = sink
+        self.max_queue = max_queue
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.stopping = False
+
+        # counters, see stats()
+        self.written = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.last_lag = 0.0
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    # Queue one entry for the writer thread; never blocks on disk
+    def write(self, line1, line2, timestamp=None):
+        entry = (line1, line2, timestamp or datetime.now(), monotonic())
+        with self.condition:
+            if len(self.queue) >= self.max_queue:
+                if self.queue[-1][0] == line1:
+                    self.queue[-1] = entry
+                    self.coalesced += 1
+                    return
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append(entry)
+            self.condition.notify()
+
+    # Stop the writer thread after it has written everything queued
+    def close(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join()
+        self.sink.close()
+
+    def stats(self):
+        with self.condition:
+            depth = len(self.queue)
+        return {
+            'queue_depth': depth,
+            'written': self.written,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'last_latency': self.last_latency,
+            'max_latency': self.max_latency,
+            'last_lag': self.last_lag,
+        }
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopping:
+                    # wake up on the flush timer even when nothing arrives
+                    if not self.condition.wait(timeout=self.sink.flush_interval):
+                        break
+                batch = list(self.queue)
+                self.queue.clear()
+                stopping = self.stopping
+
+            start = monotonic()
+            try:
+                for line1, line2, timestamp, _ in batch:
+                    self.sink.write(line1, line2, timestamp)
+                if not batch:
+                    self.sink.flush()
+            except Exception as e:
+                self.errors += 1
+                print(f"Error logging to file: {e}")
+            end = monotonic()
+
+            if batch:
+                self.written += len(batch)
+                self.last_latency = end - start
+                self.max_latency = max(self.max_latency, self.last_latency)
+                self.last_lag = end - batch[0][3]
+            if stopping:
+                return
@@ -0,0 +1,202 @@
+# Signally LCD / preindexed message corpus
+#
+# Parses every message file once into ready-to-display 16x2 frames: rows are
+# wrapped and centered up front, historical entries have their quotes and
+# literal "\n" separators decoded, and text too wide for the glass is kept
+# unpadded so the screen can scroll it as a marquee. Picks come from a shuffled
+# bag per pool selection (weighted, no repeats until the bag is empty), so a
+# pick is a list pop. Files are re-read when their mtime changes, and parsed
+# frames can be kept in a small JSON cache keyed by file mtime and size.
+import os
+import json
+import random
+import textwrap
+import threading
+from time import monotonic
+
+from atomic_file import write_json
+
+LCD_WIDTH = 16
+
+# Longest line kept for scrolling; anything longer is rejected
+MAX_LINE_LENGTH = 80
+
+# Bumped whenever the layout rules change, to invalidate compiled caches
+CACHE_VERSION = 2
+
+# One message laid out for the LCD. two_line frames use both rows; the others
+# use row 1 and leave row 2 for the clock.
+class Frame:
+    def __init__(self, pool, text, line1, line2='', two_line=False):
+        self.pool = pool
+        self.text = text
+        self.line1 = line1
+        self.line2 = line2
+        self.two_line = two_line
+
+    def to_json(self):
+        return [self.text, self.line1, self.line2, self.two_line]
+
+    @classmethod
+    def from_json(cls, pool, data):
+        return cls(pool, *data)
+
+# Lay out one message: a single row if it fits next to the clock, otherwise
+# word-wrapped across both rows. Text that doesn't fit either way is left
+# unpadded to be scrolled; None if it has more than two lines or a line
+# longer than MAX_LINE_LENGTH.
+def layout(pool, text, lines=None):
+    lines = lines or [text]
+    if len(lines) == 1 and len(lines[0]) <= LCD_WIDTH:
+        return Frame(pool, text, lines[0].center(LCD_WIDTH))
+    if len(lines) == 2 and all(len(line) <= LCD_WIDTH for line in lines):
+        return Frame(pool, text, lines[0].center(LCD_WIDTH), lines[1].center(LCD_WIDTH), True)
+    wrapped = textwrap.wrap(' '.join(lines), LCD_WIDTH)
+    if len(wrapped) <= 2:
+        wrapped += [''] * (2 - len(wrapped))
+        return Frame(pool, text, wrapped[0].center(LCD_WIDTH), wrapped[1].center(LCD_WIDTH), True)
+    if len(lines) > 2 or any(len(line) > MAX_LINE_LENGTH for line in lines):
+        return None
+    if len(lines) == 1:
+        return Frame(pool, text, lines[0])
+    return Frame(pool, text, lines[0], lines[1], True)
+
+# Parse one line of a message file into its display lines. Entries may be
+# wrapped in quotes and use a literal "\n" to separate the two rows.
+def parse_line(line):
+    line = line.strip()
+    if len(line) >= 2 and line[0] == line[-1] == '"':
+        line = line[1:-1]
+    return [part.strip() for part in line.replace('\\n', '\n').split('\n')]
+
+class MessageCorpus:
+    # files maps pool name -> path; weights maps pool name -> how many times
+    # each of its messages goes into a bag (default 1)
+    def __init__(self, files, weights=None, cache_path=None, reload_interval=30):
+        self.files = dict(files)
+        self.weights = dict(weights or {})
+        self.cache_path = cache_path
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.frames = {pool: [] for pool in self.files}
+        self.stamps = {}
+        self.bags = {}
+        self.last = {}
+        self.rejected = {}
+        self.last_check = None
+
+    # Parse every file (or take its frames from the compiled cache)
+    def load(self):
+        cache = self.read_cache()
+        with self.lock:
+            for pool, path in self.files.items():
+                self.load_pool(pool, path, cache.get(path))
+            self.bags.clear()
+            self.last_check = monotonic()
+        self.write_cache()
+
+    # Re-read any file whose mtime or size changed since it was loaded
+    def refresh(self, force=False):
+        now = monotonic()
+        if not force and self.last_check is not None and now - self.last_check < self.reload_interval:
+            return False
+        self.last_check = now
+        changed = False
+        with self.lock:
+            for pool, path in self.files.items():
+                if self.stat(path) != self.stamps.get(pool):
+                    self.load_pool(pool, path)
+                    changed = True
+            if changed:
+                self.bags.clear()
+        if changed:
+            self.write_cache()
+        return changed
+
+    def load_pool(self, pool, path, cached=None):
+        stamp = self.stat(path)
+        self.stamps[pool] = stamp
+        if cached and stamp and cached.get('stamp') == list(stamp):
+            self.frames[pool] = [Frame.from_json(pool, data) for data in cached['frames']]
+            self.rejected[pool] = cached.get('rejected', 0)
+            return
+
+        frames = []
+        rejected = 0
+        try:
+            with open(path, 'r') as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    frame = layout(pool, line.strip(), parse_line(line))
+                    if frame is None:
+                        rejected += 1
+                    else:
+                        frames.append(frame)
+        except Exception as e:
+            print(f"Error loading messages from {path}: {e}")
+        if rejected:
+            print(f"Skipped {rejected} messages in {path} that are too long to display")
+        self.frames[pool] = frames
+        self.rejected[pool] = rejected
+
+    def stat(self, path):
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+    def read_cache(self):
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path, 'r') as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+            return {}
+        return cache.get('files', {})
+
+    def write_cache(self):
+        if not self.cache_path:
+            return
+        with self.lock:
+            files = {path: {'stamp': list(self.stamps[pool]) if self.stamps.get(pool) else None,
+                            'rejected': self.rejected.get(pool, 0),
+                            'frames': [frame.to_json() for frame in self.frames[pool]]}
+                     for pool, path in self.files.items()}
+        data = {'version': CACHE_VERSION, 'files': files}
+        try:
+            write_json(self.cache_path, data)
+        except OSError as e:
+            print(f"Error saving message cache: {e}")
+
+    # Next frame from the given pools, or None if they are all empty
+    def pick(self, pools):
+        self.refresh()
+        key = tuple(pools)
+        with self.lock:
+            bag = self.bags.get(key)
+            if not bag:
+                bag = self.fill_bag(key)
+                if not bag:
+                    return None
+            frame = bag.pop()
+            # don't show the same message twice in a row across a refill
+            if frame is self.last.get(key) and bag:
+                frame, bag[-1] = bag[-1], frame
+            self.last[key] = frame
+            return frame
+
+    def fill_bag(self, key):
+        bag = []
+        for pool in key:
+            bag.extend(self.frames.get(pool, []) * self.weights.get(pool, 1))
+        random.shuffle(bag)
+        self.bags[key] = bag
+        return bag
+
+    def count(self, pool):
+        return len(self.frames.get(pool, []))
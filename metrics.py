@@ -0,0 +1,203 @@
+# Signally LCD / Prometheus-style metrics
+#
+# Counters, gauges and histograms kept in plain dicts keyed by label values,
+# rendered in the Prometheus text exposition format on a small HTTP endpoint.
+# Most numbers already exist as counters on the components (I2C bytes, missed
+# ticks, API latency, cache hits, log writer lag); collectors read those when
+# the endpoint is scraped, so the hot paths pay nothing extra for them.
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (seconds) for frame render time, which is normally well under 1ms
+RENDER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, float('inf'))
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    # (suffix, labels, value) tuples for the exposition
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield '', dict(zip(self.labels, key)), value
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=RENDER_BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += 1
+            state[2] += value
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (list(counts), count, total)) for key, (counts, count, total) in self.values.items()]
+        for key, (counts, count, total) in items:
+            labels = dict(zip(self.labels, key))
+            yield from bucket_samples(labels, self.buckets, counts, count, total)
+
+# A metric read from a component at scrape time. samples is a list of
+# (labels, value) pairs; for a histogram the value is (buckets, counts, sum).
+class Snapshot(Metric):
+    def __init__(self, kind, name, help, samples):
+        Metric.__init__(self, name, help)
+        self.kind = kind
+        self.snapshot = samples
+
+    def samples(self):
+        for labels, value in self.snapshot:
+            if self.kind == 'histogram':
+                buckets, counts, total = value
+                yield from bucket_samples(labels, buckets, counts, sum(counts), total)
+            else:
+                yield '', labels, value
+
+# Cumulative bucket, count and sum samples from per-bucket counts
+def bucket_samples(labels, buckets, counts, count, total):
+    seen = 0
+    for bound, bucket_count in zip(buckets, counts):
+        seen += bucket_count
+        yield '_bucket', dict(labels, le=format_value(bound)), seen
+    yield '_count', labels, count
+    yield '_sum', labels, total
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def add(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=RENDER_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    # collect() is called on every scrape and returns metrics filled in from
+    # a component's own counters
+    def register(self, collect):
+        with self.lock:
+            self.collectors.append(collect)
+
+    def collect(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+        for collect in collectors:
+            try:
+                metrics.extend(collect())
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        return metrics
+
+    # The whole registry in the text exposition format
+    def render(self):
+        lines = []
+        for metric in self.collect():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+# Default registry shared by the modules of the app
+registry = Registry()
+
+class MetricsServer:
+    def __init__(self, registry=registry, host='127.0.0.1', port=9105):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        # imported here so a disabled endpoint costs nothing at startup
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,160 @@
+# Signally LCD / quiet hours and wake-on-event
+#
+# Overnight nobody reads the panel, so during quiet hours the display loop
+# hands over to an idle screen: the backlight goes off, and either the display
+# is switched off entirely or a plain HH:MM clock is written once a minute.
+# Background fetching is paused, and the idle loop blocks on an event rather
+# than ticking every second. A wake source (a GPIO button or a datagram on a
+# local socket) brings the full display back for wake_duration seconds.
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from time import monotonic
+
+# Idle modes: display and backlight off, or a once-a-minute clock without backlight
+QUIET_OFF = 'off'
+QUIET_CLOCK = 'clock'
+
+LCD_WIDTH = 16
+
+# Parse "HH:MM-HH:MM" into a (start, end) pair of datetime.time, or None if empty
+def parse_quiet_hours(spec):
+    if not spec:
+        return None
+    start, _, end = spec.partition('-')
+    return (datetime.strptime(start.strip(), '%H:%M').time(),
+            datetime.strptime(end.strip(), '%H:%M').time())
+
+class PowerManager:
+    def __init__(self, quiet_hours=None, mode=QUIET_CLOCK, wake_duration=300):
+        self.quiet_hours = quiet_hours
+        self.mode = mode
+        self.wake_duration = wake_duration
+        self.wake_event = threading.Event()
+        self.awake_until = None
+        self.wakes = 0
+
+    # Quiet hours may wrap past midnight (e.g. 23:00-06:00)
+    def in_quiet_hours(self, now=None):
+        if self.quiet_hours is None:
+            return False
+        start, end = self.quiet_hours
+        current = (now or datetime.now()).time()
+        if start <= end:
+            return start <= current < end
+        return current >= start or current < end
+
+    # True while the display should be idle: quiet hours and not woken
+    def is_quiet(self, now=None):
+        if self.awake_until is not None and monotonic() < self.awake_until:
+            return False
+        return self.in_quiet_hours(now)
+
+    # Called by wake sources, from any thread
+    def wake(self):
+        self.awake_until = monotonic() + self.wake_duration
+        self.wakes += 1
+        self.wake_event.set()
+
+    # Wall-clock time quiet hours end next
+    def quiet_end(self, now=None):
+        now = now or datetime.now()
+        end = datetime.combine(now.date(), self.quiet_hours[1])
+        return end if end > now else end + timedelta(days=1)
+
+    # Block for up to timeout seconds; True if woken in the meantime
+    def wait(self, timeout):
+        woken = self.wake_event.wait(max(timeout, 0))
+        self.wake_event.clear()
+        return woken
+
+# Playlist entry shown during quiet hours; show() returns when they end or
+# someone wakes the display
+class IdleScreen:
+    def __init__(self, power, fetcher=None, name='quiet'):
+        self.power = power
+        self.fetcher = fetcher
+        self.name = name
+
+    def show(self, lcd, scheduler, log=None):
+        power = self.power
+        power.wake_event.clear()  # a wake from before quiet hours doesn't count
+        print(f"[{self.name}] {power.mode} until {power.quiet_end():%I:%M %p}")
+        if log is not None:
+            log(f"Quiet hours ({power.mode})", datetime.now().strftime("%I:%M:%S %p"))
+        if self.fetcher is not None:
+            self.fetcher.pause()
+        lcd.backlight(0)
+        try:
+            while power.is_quiet():
+                # the mode may have been changed while idle
+                if lcd.display_on != (power.mode != QUIET_OFF):
+                    lcd.lcd_display_power(power.mode != QUIET_OFF)
+                now = datetime.now()
+                if power.mode == QUIET_CLOCK:
+                    lcd.lcd_buffer_clear()
+                    lcd.lcd_buffer_string(now.strftime("%I:%M %p").center(LCD_WIDTH), 1)
+                    lcd.lcd_flush()
+                    wait = 60 - now.second - now.microsecond / 1e6
+                else:
+                    wait = (power.quiet_end(now) - now).total_seconds()
+                scheduler.expect(wait)
+                # a wake ends the loop through is_quiet(); any other set of
+                # the event (e.g. a settings change) only rechecks the schedule
+                power.wait(wait)
+        finally:
+            if not lcd.display_on:
+                lcd.lcd_display_power(True)
+            lcd.backlight(1)
+            if self.fetcher is not None:
+                self.fetcher.resume()
+
+# Wakes the display when any datagram arrives on a local Unix socket, e.g.
+#   python -c "import socket; s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM); s.sendto(b'wake', 'signally_wake.sock')"
+class SocketWake:
+    def __init__(self, power, path):
+        self.power = power
+        self.path = path
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.thread = threading.Thread(target=self.run, name='wake-socket', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.sock.recv(64)
+            except OSError:
+                return
+            self.power.wake()
+
+    def stop(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+# Wakes the display on a button press; needs gpiozero (Raspberry Pi only)
+class GpioWake:
+    def __init__(self, power, pin):
+        self.power = power
+        self.pin = pin
+        self.button = None
+
+    def start(self):
+        from gpiozero import Button
+        self.button = Button(self.pin)
+        self.button.when_pressed = self.power.wake
+
+    def stop(self):
+        if self.button is not None:
+            self.button.close()
+            self.button = None
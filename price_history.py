@@ -0,0 +1,166 @@
+# Signally LCD / per-symbol intraday price history
+#
+# Fixed-size ring buffers of (timestamp, price) points, one per symbol, kept
+# in a memory-mapped binary file so history survives restarts without any
+# parsing and memory stays bounded no matter how long the process runs.
+# Timestamps are wall-clock epoch seconds, since monotonic time does not carry
+# across restarts.
+#
+# File layout (little-endian):
+#   header   magic "SLPH", version, max_symbols, capacity
+#   slots    max_symbols x (symbol[16] UTF-8, head, count)
+#   points   max_symbols x capacity x (timestamp double, price double)
+import os
+import mmap
+import struct
+import threading
+from time import time
+
+MAGIC = b'SLPH'
+VERSION = 2
+HEADER = struct.Struct('<4sHHI')
+SYMBOL_BYTES = 16
+SLOT = struct.Struct(f'<{SYMBOL_BYTES}sII')
+POINT = struct.Struct('<dd')
+
+# Sparkline bars from lowest to highest; drawn with CGRAM glyphs on the LCD
+SPARK_LEVELS = u'▁▂▃▄▅▆▇█'
+
+class PriceHistory:
+    def __init__(self, path, max_symbols=64, capacity=256):
+        self.path = path
+        self.max_symbols = max_symbols
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.file = None
+        self.map = None
+
+    def slots_offset(self):
+        return HEADER.size
+
+    def points_offset(self):
+        return HEADER.size + SLOT.size * self.max_symbols
+
+    def file_size(self):
+        return self.points_offset() + POINT.size * self.capacity * self.max_symbols
+
+    # Map the history file, creating (or recreating) it if the layout differs
+    def open(self):
+        if self.map is not None:
+            return
+        size = self.file_size()
+        fresh = True
+        if os.path.exists(self.path) and os.path.getsize(self.path) == size:
+            with open(self.path, 'rb') as file:
+                header = file.read(HEADER.size)
+            fresh = header != HEADER.pack(MAGIC, VERSION, self.max_symbols, self.capacity)
+
+        if fresh:
+            with open(self.path, 'wb') as file:
+                file.truncate(size)
+                file.write(HEADER.pack(MAGIC, VERSION, self.max_symbols, self.capacity))
+
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.slots = {}
+        for index in range(self.max_symbols):
+            name, _, count = SLOT.unpack_from(self.map, self.slots_offset() + index * SLOT.size)
+            name = name.rstrip(b'\0').decode('utf-8', 'replace')
+            if name and count:
+                self.slots[name] = index
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.flush()
+                self.map.close()
+                self.file.close()
+                self.map = None
+                self.file = None
+
+    def flush(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.flush()
+
+    # Append a price for symbol, overwriting its oldest point when full
+    def record(self, symbol, price, timestamp=None):
+        if price is None or encode_symbol(symbol) is None:
+            return
+        timestamp = timestamp or time()
+        with self.lock:
+            if self.map is None:
+                return
+            index = self.slot_for(symbol)
+            slot_offset = self.slots_offset() + index * SLOT.size
+            name, head, count = SLOT.unpack_from(self.map, slot_offset)
+            POINT.pack_into(self.map, self.point_offset(index, head), timestamp, float(price))
+            head = (head + 1) % self.capacity
+            count = min(count + 1, self.capacity)
+            SLOT.pack_into(self.map, slot_offset, name, head, count)
+
+    # Points for symbol, oldest first; only those newer than since if given
+    def series(self, symbol, limit=None, since=None):
+        with self.lock:
+            index = self.slots.get(symbol)
+            if index is None or self.map is None:
+                return []
+            _, head, count = SLOT.unpack_from(self.map, self.slots_offset() + index * SLOT.size)
+            take = count if limit is None else min(limit, count)
+            points = []
+            for back in range(take, 0, -1):
+                position = (head - back) % self.capacity
+                points.append(POINT.unpack_from(self.map, self.point_offset(index, position)))
+        if since is not None:
+            points = [point for point in points if point[0] >= since]
+        return points
+
+    def point_offset(self, index, position):
+        return self.points_offset() + (index * self.capacity + position) * POINT.size
+
+    # Slot index for symbol; a new symbol takes a free slot, or the slot
+    # whose newest point is oldest when the table is full
+    def slot_for(self, symbol):
+        index = self.slots.get(symbol)
+        if index is not None:
+            return index
+
+        used = set(self.slots.values())
+        free = [index for index in range(self.max_symbols) if index not in used]
+        if free:
+            index = free[0]
+        else:
+            def newest(item):
+                _, slot = item
+                _, head, _ = SLOT.unpack_from(self.map, self.slots_offset() + slot * SLOT.size)
+                return POINT.unpack_from(self.map, self.point_offset(slot, (head - 1) % self.capacity))[0]
+            evicted, index = min(self.slots.items(), key=newest)
+            del self.slots[evicted]
+
+        name = encode_symbol(symbol)
+        if name is None:
+            raise ValueError(f"symbol {symbol!r} does not fit a history slot")
+        SLOT.pack_into(self.map, self.slots_offset() + index * SLOT.size, name, 0, 0)
+        self.slots[symbol] = index
+        return index
+
+# Symbol as stored in a slot, or None if it wouldn't read back the same
+# (empty, too long, or containing NUL)
+def encode_symbol(symbol):
+    name = symbol.encode('utf-8')
+    if not name or len(name) > SYMBOL_BYTES or b'\0' in name:
+        return None
+    return name
+
+# Render prices as a bar-per-point sparkline of at most width characters
+def sparkline(prices, width=16):
+    if not prices:
+        return ''
+    prices = prices[-width:]
+    low = min(prices)
+    high = max(prices)
+    if high == low:
+        return SPARK_LEVELS[len(SPARK_LEVELS) // 2 - 1] * len(prices)
+    scale = (len(SPARK_LEVELS) - 1) / (high - low)
+    return ''.join(SPARK_LEVELS[int(round((price - low) * scale))] for price in prices)
@@ -0,0 +1,172 @@
+# Signally LCD / in-memory stock quote cache
+#
+# Quotes live in memory for the life of the process. Freshness is checked
+# against time.monotonic(), so clock changes and multi-day gaps are handled
+# correctly. The cache is read from disk once at startup and written back
+# behind the caller (a timer batches changes) via a temp file and an atomic
+# rename, so a crash never leaves a half-written cache.
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from time import monotonic
+
+from atomic_file import write_json
+
+# One entry of the old stock_cache.txt format, which held repr'd datetimes:
+# {'T': {'stock_info': 'T: 18.10 (-0.18)', 'timestamp': datetime.datetime(2024, 6, 8, 13, 22, 54, 650903)}}
+LEGACY_ENTRY = re.compile(
+    r"'(?P<symbol>[^']+)':\s*\{'stock_info':\s*'(?P<stock_info>[^']*)',\s*"
+    r"'timestamp':\s*datetime\.datetime\((?P<timestamp>[\d,\s]+)\)\}")
+
+class QuoteCache:
+    def __init__(self, path, ttl=1800, max_entries=64, write_delay=30, legacy_path=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.write_delay = write_delay
+        self.legacy_path = legacy_path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.timer = None
+        self.hits = 0
+        self.misses = 0
+
+    # Read the cache file (or migrate the legacy one) into memory
+    def load(self):
+        if os.path.exists(self.path):
+            records = self.read_json(self.path)
+        elif self.legacy_path and os.path.exists(self.legacy_path):
+            records = self.read_legacy(self.legacy_path)
+            if records:
+                print(f"Migrated {len(records)} quotes from {self.legacy_path}")
+        else:
+            records = {}
+
+        now = datetime.now()
+        with self.lock:
+            self.entries.clear()
+            for symbol, record in sorted(records.items(), key=lambda item: item[1]['timestamp']):
+                age = max((now - record['timestamp']).total_seconds(), 0)
+                self.entries[symbol] = dict(record, fetched=monotonic() - age)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # Parse stock_cache.json; entries with a malformed timestamp are skipped
+    def read_json(self, path):
+        try:
+            with open(path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Error loading stock cache: {e}")
+            return {}
+        records = {}
+        for symbol, entry in data.items() if isinstance(data, dict) else ():
+            try:
+                records[symbol] = {
+                    'stock_info': entry['stock_info'],
+                    'price': entry.get('price'),
+                    'change': entry.get('change'),
+                    'timestamp': datetime.fromisoformat(entry['timestamp']),
+                }
+            except (TypeError, KeyError, ValueError) as e:
+                print(f"Skipping malformed stock cache entry {symbol}: {e}")
+        return records
+
+    # Parse the old repr-based stock_cache.txt, rejecting it if nothing matches
+    def read_legacy(self, path):
+        try:
+            with open(path, 'r') as file:
+                text = file.read()
+        except OSError as e:
+            print(f"Error loading legacy stock cache: {e}")
+            return {}
+        records = {}
+        for match in LEGACY_ENTRY.finditer(text):
+            try:
+                timestamp = datetime(*[int(part) for part in match.group('timestamp').split(',')])
+            except (TypeError, ValueError):
+                continue
+            records[match.group('symbol')] = {
+                'stock_info': match.group('stock_info'),
+                'price': None,
+                'change': None,
+                'timestamp': timestamp,
+            }
+        if text.strip() and not records:
+            print(f"Ignoring unrecognized legacy stock cache {path}")
+        return records
+
+    # Those of symbols with an entry younger than the TTL; counted as one
+    # lookup, a hit if any was fresh
+    def fresh(self, symbols):
+        with self.lock:
+            now = monotonic()
+            found = [symbol for symbol in symbols
+                     if symbol in self.entries and now - self.entries[symbol]['fetched'] < self.ttl]
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return found
+
+    # Entry for symbol regardless of age, or None
+    def peek(self, symbol):
+        with self.lock:
+            return self.entries.get(symbol)
+
+    # Seconds since symbol was fetched, or None if it has never been
+    def age(self, symbol):
+        with self.lock:
+            entry = self.entries.get(symbol)
+            return monotonic() - entry['fetched'] if entry else None
+
+    def put(self, symbol, stock_info, price=None, change=None):
+        with self.lock:
+            self.entries[symbol] = {
+                'stock_info': stock_info,
+                'price': price,
+                'change': change,
+                'timestamp': datetime.now(),
+                'fetched': monotonic(),
+            }
+            self.entries.move_to_end(symbol)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+            if self.timer is None:
+                self.timer = threading.Timer(self.write_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    # Write the cache to disk if it changed (temp file + atomic rename)
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return
+            data = {symbol: {'stock_info': entry['stock_info'],
+                             'price': entry['price'],
+                             'change': entry['change'],
+                             'timestamp': entry['timestamp'].isoformat()}
+                    for symbol, entry in self.entries.items()}
+            self.dirty = False
+        try:
+            write_json(self.path, data)
+        except Exception as e:
+            print(f"Error saving stock cache: {e}")
+            with self.lock:
+                self.dirty = True
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,157 @@
+# Signally LCD / declarative screens and playlist
+#
+# A Screen is a phase of the display cycle: static rows that are padded once
+# when the screen is built, plus dynamic fields that each redraw on their own
+# refresh period. Static rows go into the LCD framebuffer once per phase; after
+# the first flush only the changed cells of the dynamic fields reach the bus.
+# A Playlist is the ordered list of screen factories main() cycles through.
+#
+# Text wider than the LCD scrolls as a marquee. When no row has to stay put,
+# both rows are loaded into the controller's 40-character DDRAM lines once
+# and scrolled with the display-shift command (one command byte per step).
+# When a row must stay static (the clock), the long row scrolls in software
+# through the framebuffer, which still only sends the cells that changed.
+LCD_WIDTH = 16
+
+# Characters the controller keeps per line for hardware scrolling
+DDRAM_LINE = 40
+
+# Seconds per marquee step, and blank columns between repeats of the text
+MARQUEE_PERIOD = 0.4
+MARQUEE_GAP = 4
+
+# Pad or cut text to exactly one centered LCD row
+def pad_row(text):
+    return text.center(LCD_WIDTH)[:LCD_WIDTH]
+
+# A row whose content is computed from the frame time
+class Field:
+    def __init__(self, row, render, refresh=1):
+        self.row = row
+        self.render = render
+        self.refresh = refresh
+
+# The time of day on a row, redrawn every second
+def clock_field(row=2):
+    return Field(row, lambda now: pad_row(now.strftime("%I:%M:%S %p")))
+
+# Text scrolled through a row in software, one character per frame
+class MarqueeField(Field):
+    def __init__(self, row, text, gap=MARQUEE_GAP):
+        self.loop = text + ' ' * gap
+        self.strip = self.loop * (LCD_WIDTH // len(self.loop) + 2)
+        self.offset = 0
+        Field.__init__(self, row, self.next_window)
+
+    def next_window(self, now):
+        window = self.strip[self.offset:self.offset + LCD_WIDTH]
+        self.offset = (self.offset + 1) % len(self.loop)
+        return window
+
+class Screen:
+    def __init__(self, name, duration, line1='', line2='', fields=(), log_text=None,
+                 period=1.0, hardware_scroll=False):
+        self.name = name
+        self.duration = duration
+        self.hardware_scroll = hardware_scroll
+        if hardware_scroll:
+            self.rows = [line1 + ' ' * MARQUEE_GAP, line2 + ' ' * MARQUEE_GAP]
+        else:
+            self.rows = [pad_row(line1), pad_row(line2)]
+        self.fields = list(fields)
+        self.log_text = log_text if log_text is not None else line1
+        self.period = period
+
+    # Show the screen for its duration, one frame per scheduler tick
+    def show(self, lcd, scheduler, log=None):
+        lcd.lcd_buffer_clear()
+        if self.hardware_scroll:
+            for row, text in enumerate(self.rows, start=1):
+                lcd.lcd_marquee_load(text, row)
+        else:
+            for row, text in enumerate(self.rows, start=1):
+                if not any(field.row == row for field in self.fields):
+                    lcd.lcd_buffer_string(text, row)
+        print(f"[{self.name}] {self.log_text}")
+
+        frame = [0]
+        logged = [None]
+
+        def render(now):
+            if self.hardware_scroll:
+                if frame[0]:
+                    lcd.lcd_marquee_step()
+            else:
+                for field in self.fields:
+                    if frame[0] % field.refresh == 0:
+                        lcd.lcd_buffer_string(field.render(now), field.row)
+                lcd.lcd_flush()
+            frame[0] += 1
+            time_str = now.strftime("%I:%M:%S %p")
+            if log is not None and time_str != logged[0]:
+                logged[0] = time_str
+                log(self.log_text, time_str)
+
+        try:
+            scheduler.run(int(round(self.duration / self.period)), render, self.period)
+        finally:
+            if self.hardware_scroll:
+                lcd.lcd_marquee_reset()
+
+# One line of text above the clock; text wider than the LCD scrolls in
+# software so the clock row stays put
+def clock_screen(name, duration, text):
+    if len(text) <= LCD_WIDTH:
+        return Screen(name, duration, text, fields=[clock_field()])
+    return Screen(name, duration, fields=[MarqueeField(1, text), clock_field()],
+                  log_text=text, period=MARQUEE_PERIOD)
+
+# Two rows of text; if either is wider than the LCD both rows scroll together
+# with the display-shift command, as long as each fits in a DDRAM line
+def two_line_screen(name, duration, line1, line2, log_text=None):
+    if max(len(line1), len(line2)) <= LCD_WIDTH:
+        return Screen(name, duration, line1, line2, log_text=log_text)
+    if max(len(line1), len(line2)) + MARQUEE_GAP <= DDRAM_LINE:
+        return Screen(name, duration, line1, line2, log_text=log_text,
+                      period=MARQUEE_PERIOD, hardware_scroll=True)
+    return Screen(name, duration, fields=[MarqueeField(1, line1), MarqueeField(2, line2)],
+                  log_text=log_text, period=MARQUEE_PERIOD)
+
+class Playlist:
+    # entries are callables returning the next Screen (or None to skip);
+    # after_cycle runs once each time the list has been played through.
+    # priority, if given, returns a Screen to show ahead of the next entry
+    # (or None); setting the scheduler's preempt event cuts the current
+    # screen short so it is shown right away.
+    def __init__(self, entries, after_cycle=None, priority=None):
+        self.entries = list(entries)
+        self.after_cycle = after_cycle
+        self.priority = priority
+        self.position = 0
+        self.current = None
+
+    def run(self, lcd, scheduler, log=None):
+        while True:
+            self.play_next(lcd, scheduler, log)
+
+    # Show the screen at the current position and advance
+    def play_next(self, lcd, scheduler, log=None):
+        # cleared before looking for priority screens, so one pushed after
+        # this point cuts the next screen short instead of being missed
+        preempt = getattr(scheduler, 'preempt', None)
+        if preempt is not None:
+            preempt.clear()
+        if self.priority is not None:
+            screen = self.priority()
+            if screen is not None:
+                self.current = screen
+                screen.show(lcd, scheduler, log)
+                return
+
+        screen = self.entries[self.position]()
+        if screen is not None:
+            self.current = screen
+            screen.show(lcd, scheduler, log)
+        self.position = (self.position + 1) % len(self.entries)
+        if self.position == 0 and self.after_cycle is not None:
+            self.after_cycle()
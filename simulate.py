@@ -0,0 +1,421 @@
+# Signally LCD / simulation mode
+#
+# Runs lcdtimedate.main() on a virtual clock: datetime.now(), time(),
+# monotonic() and every sleep in the display path read and advance the same
+# simulated time, API calls are answered from recorded fixtures, fetches run
+# inline instead of on the thread pool, and the LCD is the emulator. A whole
+# simulated day (stock windows, quiet hours, weather refreshes, log rotation)
+# runs in seconds and reports the API calls spent, frames rendered, event log
+# bytes written and what each playlist phase cost to render, so scheduler and
+# budget changes can be compared run against run.
+#
+#   python simulate.py                               # today, 24 hours
+#   python simulate.py --start 2026-10-19 --hours 48 --json day.json
+#   python simulate.py record                        # refresh fixtures/ from the real APIs
+import sys
+import os
+import io
+import copy
+import json
+import random
+import tempfile
+import contextlib
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from time import perf_counter
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'I2C_LCD_driver'))
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Monotonic clock reading at the start of a simulation, as if the Pi had been up a while
+MONOTONIC_START = 1000.0
+
+# Raised from the virtual clock when the simulated period is over; not an
+# Exception, so the display loop's supervisor lets it through
+class SimulationDone(BaseException):
+    pass
+
+class VirtualClock:
+    def __init__(self, start, end=None):
+        self.now = start.timestamp()
+        self.origin = self.now
+        self.end = end.timestamp() if end is not None else None
+        self.datetime = virtual_datetime(self)
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return MONOTONIC_START + self.now - self.origin
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+        if self.end is not None and self.now >= self.end:
+            raise SimulationDone()
+
+# datetime whose now() reads the virtual clock
+def virtual_datetime(clock):
+    class VirtualDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls.fromtimestamp(clock.time(), tz)
+    return VirtualDatetime
+
+# Module attributes replaced by the clock: module name -> {attribute: clock method}
+CLOCK_PATCHES = {
+    'lcdtimedate': {'datetime': 'datetime', 'sleep': 'sleep'},
+    'api_budget': {'datetime': 'datetime'},
+    'quote_cache': {'datetime': 'datetime', 'monotonic': 'monotonic'},
+    'weather_cache': {'time': 'time', 'monotonic': 'monotonic'},
+    'price_history': {'time': 'time'},
+    'power': {'datetime': 'datetime', 'monotonic': 'monotonic'},
+    'event_log': {'datetime': 'datetime', 'monotonic': 'monotonic'},
+    'message_corpus': {'monotonic': 'monotonic'},
+}
+
+# Point the app's modules and frame scheduler at the clock, restoring them on exit
+@contextlib.contextmanager
+def installed(clock):
+    import lcdtimedate
+    saved = []
+    for module_name, patches in CLOCK_PATCHES.items():
+        module = sys.modules[module_name]
+        for attribute, method in patches.items():
+            saved.append((module, attribute, getattr(module, attribute)))
+            setattr(module, attribute, getattr(clock, method))
+    scheduler = lcdtimedate.frame_scheduler
+    power = lcdtimedate.power
+    for target, attribute, value in ((scheduler, 'sleep', clock.sleep), (scheduler, 'monotonic', clock.monotonic),
+                                     (scheduler, 'time', clock.time),
+                                     (power, 'wait', lambda timeout: clock.sleep(timeout) or False)):
+        saved.append((target, attribute, getattr(target, attribute)))
+        setattr(target, attribute, value)
+    try:
+        yield clock
+    finally:
+        for target, attribute, value in reversed(saved):
+            setattr(target, attribute, value)
+
+# Fixture name for an API URL
+def fixture_name(url):
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    if 'function' in query:
+        return 'alpha_vantage_' + query['function'][0].lower()
+    if '/multi-quote/' in parts.path:
+        return 'rapidapi_multi_quote'
+    if '/price/' in parts.path:
+        return 'rapidapi_price'
+    return 'openweathermap_' + parts.path.rstrip('/').rsplit('/', 1)[-1]
+
+# Stands in for lcdtimedate.api_client: answers from fixtures/<name>.json,
+# adjusted to the request (symbols asked for, forecast times after now) and
+# with quote prices on a seeded random walk. A missing fixture is a failed call.
+class FixtureClient:
+    def __init__(self, directory, clock, seed=1):
+        self.directory = directory
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.fixtures = {}
+        self.prices = {}
+        self.calls = Counter()
+
+    def get_json(self, url, headers=None, params=None, timeout=None):
+        from api_client import ApiError
+
+        name = fixture_name(url)
+        self.calls[name] += 1
+        data = self.fixture(name)
+        if data is None:
+            raise ApiError(f"no fixture for {name}")
+        adapt = getattr(self, 'adapt_' + name, None)
+        return adapt(copy.deepcopy(data), url) if adapt else copy.deepcopy(data)
+
+    def fixture(self, name):
+        if name not in self.fixtures:
+            try:
+                with open(os.path.join(self.directory, name + '.json'), 'r') as file:
+                    self.fixtures[name] = json.load(file)
+            except FileNotFoundError:
+                self.fixtures[name] = None
+        return self.fixtures[name]
+
+    # Next (price, change) for symbol, starting from the recorded price
+    def quote(self, symbol, price):
+        previous = self.prices.get(symbol, price)
+        price = round(previous * (1 + self.random.gauss(0, 0.002)), 2)
+        self.prices[symbol] = price
+        return price, round(price - previous, 2)
+
+    def adapt_openweathermap_forecast(self, data, url):
+        slots = data.get('list', [])
+        if slots:
+            step = 3 * 3600
+            shift = (int(self.clock.time()) // step + 1) * step - slots[0]['dt']
+            for slot in slots:
+                slot['dt'] += shift
+        return data
+
+    def adapt_alpha_vantage_global_quote(self, data, url):
+        symbol = parse_qs(urlsplit(url).query)['symbol'][0]
+        quote = data['Global Quote']
+        price, change = self.quote(symbol, float(quote['05. price']))
+        quote.update({'01. symbol': symbol, '05. price': f"{price:.4f}", '09. change': f"{change:.4f}"})
+        return data
+
+    def adapt_rapidapi_multi_quote(self, data, url):
+        symbols = urlsplit(url).path.rsplit('/', 1)[-1].split(',')
+        template = next(iter(data.values()))
+        quotes = {}
+        for symbol in symbols:
+            quote = copy.deepcopy(data.get(symbol, template))
+            price, change = self.quote(symbol, quote['regularMarketPrice']['raw'])
+            quote['symbol'] = symbol
+            quote['regularMarketPrice']['raw'] = price
+            quote['regularMarketChange']['raw'] = change
+            quotes[symbol] = quote
+        return quotes
+
+    def stats(self):
+        return {}
+
+# Stands in for FetchScheduler: every fetch runs on the spot, so results are
+# ready (and reproducible) the moment they are requested
+class InlineFetcher:
+    def __init__(self, max_workers=None):
+        self.results = {}
+        self.paused = False
+
+    def request(self, name, fetch, *args):
+        if self.paused:
+            return False
+        self.results[name] = fetch(*args)
+        return True
+
+    def take(self, name, default=None):
+        return self.results.pop(name, default)
+
+    def pending(self, name):
+        return False
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        pass
+
+# Render cost of one playlist phase
+class PhaseStats:
+    def __init__(self):
+        self.shown = 0
+        self.frames = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.cpu = 0.0
+
+    def to_json(self):
+        return {'shown': self.shown, 'frames': self.frames, 'seconds': self.seconds,
+                'i2c_bytes': self.bytes, 'cpu_seconds': self.cpu}
+
+# Playlist factory whose screens record their render cost per phase
+def measured_playlist(phases, clock, bus, scheduler):
+    from screens import Playlist
+
+    def measured(entry):
+        def build():
+            screen = entry()
+            if screen is not None:
+                show = screen.show
+
+                def measured_show(lcd, scheduler_arg, log=None):
+                    stats = phases[screen.name]
+                    frames, sent, started, cpu = scheduler.frames, bus.bytes_written, clock.time(), perf_counter()
+                    try:
+                        return show(lcd, scheduler_arg, log)
+                    finally:
+                        stats.shown += 1
+                        stats.frames += scheduler.frames - frames
+                        stats.bytes += bus.bytes_written - sent
+                        stats.seconds += clock.time() - started
+                        stats.cpu += perf_counter() - cpu
+                screen.show = measured_show
+            return screen
+        return build
+
+    def playlist(entries, after_cycle=None, priority=None):
+        return Playlist([measured(entry) for entry in entries], after_cycle,
+                        measured(priority) if priority is not None else None)
+    return playlist
+
+class SimulationReport:
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.wall = 0.0
+        self.calls = Counter()
+        self.budget = {}
+        self.frames = 0
+        self.missed = 0
+        self.i2c_bytes = 0
+        self.log = {}
+        self.phases = {}
+
+    def to_json(self):
+        return {'start': self.start.isoformat(), 'end': self.end.isoformat(), 'wall_seconds': self.wall,
+                'api_calls': dict(self.calls), 'api_budget': self.budget, 'frames': self.frames,
+                'missed_frames': self.missed, 'i2c_bytes': self.i2c_bytes, 'event_log': self.log,
+                'phases': {name: stats.to_json() for name, stats in self.phases.items()}}
+
+    def lines(self):
+        simulated = (self.end - self.start).total_seconds()
+        yield (f"simulated {self.start:%Y-%m-%d %H:%M} - {self.end:%Y-%m-%d %H:%M} "
+               f"({simulated / 3600:.1f} h) in {self.wall:.2f} s ({simulated / max(self.wall, 1e-9):,.0f}x)")
+        yield "api calls  " + ('  '.join(f"{name}={count}" for name, count in sorted(self.calls.items())) or 'none')
+        yield "budget     " + '  '.join(f"{name}={left['used_today']}/{left['used_today'] + left['remaining_today']}"
+                                        for name, left in self.budget.items()) + "  (last simulated day)"
+        yield f"frames     rendered={self.frames}  missed={self.missed}  i2c bytes={self.i2c_bytes}"
+        yield (f"event log  entries={self.log['entries']}  records={self.log['records']}  "
+               f"bytes={self.log['bytes']}  segments={self.log['segments']}")
+        yield f"{'phase':<12}{'shown':>7}{'frames':>9}{'seconds':>10}{'i2c bytes':>11}{'cpu ms':>10}{'us/frame':>10}"
+        for name, stats in sorted(self.phases.items(), key=lambda item: -item[1].cpu):
+            per_frame = stats.cpu * 1e6 / stats.frames if stats.frames else 0.0
+            yield (f"{name:<12}{stats.shown:>7}{stats.frames:>9}{stats.seconds:>10.0f}{stats.bytes:>11}"
+                   f"{stats.cpu * 1000:>10.1f}{per_frame:>10.1f}")
+
+# Placeholder settings so every feature is on; fixtures answer the calls
+def simulation_environment():
+    os.environ['LCD_TRANSPORT'] = 'emulator'
+    for name in ('METRICS_PORT', 'CONTROL_PORT', 'WAKE_SOCKET', 'WAKE_GPIO_PIN', 'LCD_PANELS', 'WATCHDOG_TIMEOUT'):
+        os.environ[name] = ''
+    for name in ('OPENWEATHERMAP_API_KEY', 'ALPHA_VANTAGE_API_KEY', 'RAPIDAPI_KEY', 'CITY_NAME'):
+        os.environ.setdefault(name, 'simulation')
+    # a simulated day includes a night of quiet hours unless told otherwise
+    os.environ.setdefault('QUIET_HOURS', '23:00-06:00')
+
+# Run main() from start for the given number of simulated hours
+def simulate(start, hours=24, fixtures=DEFAULT_FIXTURES, seed=1):
+    simulation_environment()
+    import lcdtimedate
+    import I2C_LCD_driver
+    import lcd_emulator
+    from event_log import EventLog, segment_paths
+
+    end = start + timedelta(hours=hours)
+    clock = VirtualClock(start, end)
+    report = SimulationReport(start, end)
+    random.seed(seed)
+    bus = lcd_emulator.LCDEmulator()
+    lcd = I2C_LCD_driver.lcd(transport=bus)
+    client = FixtureClient(fixtures, clock, seed)
+    phases = defaultdict(PhaseStats)
+    scheduler = lcdtimedate.frame_scheduler
+
+    with tempfile.TemporaryDirectory() as scratch, installed(clock):
+        for state in (lcdtimedate.stock_cache, lcdtimedate.api_budget, lcdtimedate.weather_cache,
+                      lcdtimedate.price_history, lcdtimedate.state_snapshot):
+            state.path = os.path.join(scratch, os.path.basename(state.path))
+        lcdtimedate.message_corpus.cache_path = os.path.join(scratch, 'message_cache.json')
+        log_dir = os.path.join(scratch, 'logs')
+        # written in the display thread, so log output is reproducible too
+        event_log = EventLog(log_dir, max_bytes=lcdtimedate.LOG_SEGMENT_BYTES, max_age=lcdtimedate.LOG_SEGMENT_AGE,
+                             retention_days=lcdtimedate.LOG_RETENTION_DAYS,
+                             flush_interval=lcdtimedate.LOG_FLUSH_INTERVAL)
+        lcdtimedate.log_writer = event_log
+        lcdtimedate.api_client = client
+        lcdtimedate.initialize_lcd = lambda *args, **kwargs: lcd
+        lcdtimedate.FetchScheduler = InlineFetcher
+        lcdtimedate.Playlist = measured_playlist(phases, clock, bus, scheduler)
+
+        frames, missed = scheduler.frames, scheduler.missed
+        started = perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                lcdtimedate.main()
+        except SimulationDone:
+            pass
+        report.wall = perf_counter() - started
+        lcdtimedate.close_log_writer()
+        lcdtimedate.stock_cache.flush()
+        lcdtimedate.price_history.close()
+
+        report.calls = client.calls
+        # read just before the end, so a run ending at midnight doesn't see the reset
+        report.budget = lcdtimedate.api_budget.remaining(clock.datetime.fromtimestamp(clock.time() - 1))
+        report.frames = scheduler.frames - frames
+        report.missed = scheduler.missed - missed
+        report.i2c_bytes = bus.bytes_written
+        segments = segment_paths(log_dir)
+        report.log = {'entries': event_log.entries, 'records': event_log.records, 'segments': len(segments),
+                      'rotations': event_log.rotations, 'bytes': sum(os.path.getsize(path) for path in segments)}
+        report.phases = dict(phases)
+    return report
+
+# Call each API once with the keys from .env and save the answers as fixtures
+def record(fixtures=DEFAULT_FIXTURES):
+    import lcdtimedate
+
+    client = lcdtimedate.api_client
+    get_json = client.get_json
+    os.makedirs(fixtures, exist_ok=True)
+
+    def recording_get_json(url, *args, **kwargs):
+        data = get_json(url, *args, **kwargs)
+        path = os.path.join(fixtures, fixture_name(url) + '.json')
+        with open(path, 'w') as file:
+            json.dump(data, file)
+        print(f"Recorded {path}")
+        return data
+
+    client.get_json = recording_get_json
+    lcdtimedate.load_data()
+    symbols = lcdtimedate.stock_symbols[:3]
+    if lcdtimedate.weather_configured():
+        lcdtimedate.get_weather()
+        lcdtimedate.get_weather_forecast()
+    if symbols and lcdtimedate.stock_provider_configured('alpha_vantage'):
+        lcdtimedate.get_stock_price_alpha_vantage(symbols[0])
+    if symbols and lcdtimedate.stock_provider_configured('rapidapi'):
+        lcdtimedate.get_stock_prices_rapidapi(symbols)
+    if not (lcdtimedate.weather_configured() or lcdtimedate.stock_providers_configured()):
+        print("No API keys configured; nothing recorded")
+        return 1
+    return 0
+
+# Command line: python simulate.py [--start YYYY-MM-DD[THH:MM]] [--hours N] [--seed N]
+#                                  [--fixtures DIR] [--json out.json]
+#               python simulate.py record [--fixtures DIR]
+def main(argv):
+    args = list(argv)
+    command = args.pop(0) if args and args[0] == 'record' else 'run'
+    options = {'--start': None, '--hours': '24', '--seed': '1', '--fixtures': DEFAULT_FIXTURES, '--json': None}
+    while args:
+        arg = args.pop(0)
+        if arg not in options or not args:
+            print("usage: python simulate.py [record] [--start YYYY-MM-DD[THH:MM]] [--hours N] [--seed N] "
+                  "[--fixtures DIR] [--json FILE]")
+            return 2
+        options[arg] = args.pop(0)
+
+    if command == 'record':
+        return record(options['--fixtures'])
+
+    if options['--start']:
+        start = datetime.fromisoformat(options['--start'])
+    else:
+        start = datetime.combine(datetime.now().date(), datetime.min.time())
+    report = simulate(start, float(options['--hours']), options['--fixtures'], int(options['--seed']))
+    for line in report.lines():
+        print(line)
+    if options['--json']:
+        with open(options['--json'], 'w') as file:
+            json.dump(report.to_json(), file, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,176 @@
+# Signally LCD / supervisor, watchdog and state snapshots
+#
+# Keeps the display running through failures at three levels:
+#
+# - Supervisor reruns the display loop after an unexpected exception, with a
+#   growing delay, and gives up (letting the process exit for the service
+#   manager to restart) only if it keeps failing.
+# - Watchdog checks that every frame scheduler is still beating. A loop stuck
+#   in a call that never returns can't be recovered in-process, so on a stall
+#   it saves a snapshot and exits the process; under systemd it also sends
+#   the WATCHDOG=1 keep-alives, which stop if the watchdog itself hangs.
+# - StateSnapshot keeps a small JSON file of runtime state (playlist
+#   position, what was on screen) that a restart within max_age seconds
+#   resumes from: no opening animation and no LCD clear. Quotes, budgets and
+#   weather are already persisted by their own caches, so nothing is re-fetched.
+import os
+import sys
+import json
+import socket
+import threading
+import traceback
+from time import monotonic, sleep, time
+
+from atomic_file import write_json
+
+# Exit status after a stall, for the service manager to restart on
+EXIT_STALLED = 75
+
+# Send a notification to systemd if running as a Type=notify service
+def notify_systemd(message):
+    path = os.environ.get('NOTIFY_SOCKET')
+    if not path:
+        return False
+    if path.startswith('@'):
+        path = '\0' + path[1:]  # abstract namespace
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(message.encode('ascii'), path)
+    except OSError:
+        return False
+    return True
+
+class StateSnapshot:
+    def __init__(self, path, max_age=120):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.last = None
+        self.saves = 0
+
+    # Write state if it changed since the last save (temp file + atomic rename)
+    def save(self, state, force=False):
+        with self.lock:
+            if not force and state == self.last:
+                return False
+            data = dict(state, saved=time())
+            try:
+                write_json(self.path, data)
+            except Exception as e:
+                print(f"Error saving state snapshot: {e}")
+                return False
+            self.last = dict(state)
+            self.saves += 1
+            return True
+
+    # The saved state, or None if there is none or it is older than max_age
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring state snapshot: {e}")
+            return None
+        if not isinstance(data, dict):
+            return None
+        try:
+            age = time() - float(data.pop('saved'))
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not 0 <= age <= self.max_age:
+            return None
+        return data
+
+class Watchdog:
+    # on_tick(), if given, runs on every check (e.g. to save a snapshot);
+    # on_stall(name, seconds) runs once when a scheduler stops beating
+    def __init__(self, timeout=60, interval=5, on_tick=None, on_stall=None):
+        self.timeout = timeout
+        self.interval = interval
+        self.on_tick = on_tick
+        self.on_stall = on_stall
+        self.schedulers = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stalls = 0
+
+    def watch(self, name, scheduler):
+        self.schedulers[name] = scheduler
+
+    # Seconds each stalled scheduler is overdue by, on the scheduler's own clock
+    def stalled(self):
+        overdue = {}
+        for name, scheduler in list(self.schedulers.items()):
+            next_beat = scheduler.next_beat
+            if next_beat is not None and scheduler.monotonic() - next_beat > self.timeout:
+                overdue[name] = scheduler.monotonic() - next_beat
+        return overdue
+
+    def start(self):
+        notify_systemd('READY=1')
+        self.thread = threading.Thread(target=self.run, name='watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            if self.on_tick is not None:
+                try:
+                    self.on_tick()
+                except Exception as e:
+                    print(f"Error in watchdog tick: {e}")
+            overdue = self.stalled()
+            if not overdue:
+                notify_systemd('WATCHDOG=1')
+                continue
+            self.stalls += 1
+            for name, seconds in overdue.items():
+                print(f"Watchdog: {name} has not rendered a frame for {seconds:.0f}s")
+                if self.on_stall is not None:
+                    self.on_stall(name, seconds)
+            return
+
+# Default stall handler: the stuck thread can't be stopped, so leave the
+# restart to the service manager
+def exit_stalled(name, seconds):
+    sys.stdout.flush()
+    os._exit(EXIT_STALLED)
+
+class Supervisor:
+    # Gives up once max_restarts failures happen within window seconds
+    def __init__(self, max_restarts=5, window=300, delay=1.0, max_delay=60.0):
+        self.max_restarts = max_restarts
+        self.window = window
+        self.delay = delay
+        self.max_delay = max_delay
+        self.failures = []
+        self.restarts = 0
+        self.last_error = None
+
+    # Call target() until it returns; after an exception, on_restart(error)
+    # runs before the next attempt. KeyboardInterrupt and SystemExit pass through.
+    def run(self, target, on_restart=None):
+        while True:
+            try:
+                return target()
+            except Exception as e:
+                self.last_error = e
+                now = monotonic()
+                self.failures = [t for t in self.failures if now - t < self.window] + [now]
+                print(f"Display loop failed: {e!r}")
+                traceback.print_exc()
+                if len(self.failures) > self.max_restarts:
+                    print(f"Giving up after {len(self.failures)} failures in {self.window}s")
+                    raise
+                delay = min(self.delay * 2 ** (len(self.failures) - 1), self.max_delay)
+                sleep(delay)
+                self.restarts += 1
+                if on_restart is not None:
+                    on_restart(e)
@@ -0,0 +1,144 @@
+# Signally LCD / weather cache
+#
+# The current observation and the 3-hourly forecast from OpenWeatherMap, kept
+# in memory and served stale-while-revalidate: the weather screen always shows
+# what is cached, and a refresh is only started (in the background) once the
+# observation is older than refresh_age or the forecast older than
+# forecast_refresh_age. An observation older than max_age is no longer shown;
+# the forecast slot for the current time stands in for it, so after quiet hours
+# or a network outage the screen shows an estimate instead of "N/A". Failed
+# refreshes back off exponentially. The last good observation and forecast are
+# saved to disk, so a restart shows real data before the first call.
+import json
+import threading
+from time import monotonic, time
+
+from atomic_file import write_json
+
+# OpenWeatherMap forecast slots are this many seconds apart
+FORECAST_STEP = 3 * 3600
+
+class WeatherCache:
+    def __init__(self, path, refresh_age=1800, forecast_refresh_age=3 * 3600, max_age=3 * 3600,
+                 retry_delay=60, max_retry_delay=1800):
+        self.path = path
+        self.refresh_age = refresh_age
+        self.forecast_refresh_age = forecast_refresh_age
+        self.max_age = max_age
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lock = threading.Lock()
+        self.observation = None  # {'temp', 'condition', 'timestamp', 'fetched'}
+        self.forecast = []       # [{'time', 'temp', 'condition'}], oldest first
+        self.forecast_fetched = None
+        self.failures = 0
+        self.retry_at = 0.0
+
+    # Restore the observation and forecast saved by a previous run; ages are
+    # carried over from the wall clock into monotonic time
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error loading weather cache: {e}")
+            return
+        now = time()
+        with self.lock:
+            try:
+                observation = data.get('observation')
+                if observation:
+                    age = max(now - float(observation['timestamp']), 0)
+                    self.observation = {'temp': int(observation['temp']),
+                                        'condition': str(observation['condition']),
+                                        'timestamp': float(observation['timestamp']),
+                                        'fetched': monotonic() - age}
+                if data.get('forecast_timestamp'):
+                    age = max(now - float(data['forecast_timestamp']), 0)
+                    self.forecast = [{'time': int(slot['time']), 'temp': int(slot['temp']),
+                                      'condition': str(slot['condition'])}
+                                     for slot in data.get('forecast', [])]
+                    self.forecast_fetched = monotonic() - age
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                print(f"Ignoring malformed weather cache: {e}")
+
+    # Write the cache to disk (temp file + atomic rename)
+    def save(self):
+        with self.lock:
+            data = {'observation': None, 'forecast': self.forecast, 'forecast_timestamp': None}
+            if self.observation is not None:
+                data['observation'] = {key: self.observation[key] for key in ('temp', 'condition', 'timestamp')}
+            if self.forecast_fetched is not None:
+                data['forecast_timestamp'] = time() - (monotonic() - self.forecast_fetched)
+        try:
+            write_json(self.path, data)
+        except Exception as e:
+            print(f"Error saving weather cache: {e}")
+
+    def put_observation(self, temp, condition):
+        with self.lock:
+            self.observation = {'temp': temp, 'condition': condition, 'timestamp': time(), 'fetched': monotonic()}
+            self.failures = 0
+        self.save()
+
+    # slots are (epoch seconds, temp, condition) tuples
+    def put_forecast(self, slots):
+        with self.lock:
+            self.forecast = [{'time': int(slot_time), 'temp': temp, 'condition': condition}
+                             for slot_time, temp, condition in sorted(slots)]
+            self.forecast_fetched = monotonic()
+            self.failures = 0
+        self.save()
+
+    # Count a failed refresh and hold off the next one
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            delay = min(self.retry_delay * 2 ** (self.failures - 1), self.max_retry_delay)
+            self.retry_at = monotonic() + delay
+
+    # Seconds since the observation was fetched, or None if there is none
+    def age(self):
+        with self.lock:
+            return monotonic() - self.observation['fetched'] if self.observation else None
+
+    def forecast_age(self):
+        with self.lock:
+            return monotonic() - self.forecast_fetched if self.forecast_fetched is not None else None
+
+    def observation_due(self):
+        age = self.age()
+        return age is None or age >= self.refresh_age
+
+    def forecast_due(self):
+        age = self.forecast_age()
+        return age is None or age >= self.forecast_refresh_age
+
+    # True if a refresh should be started now
+    def due(self):
+        with self.lock:
+            if monotonic() < self.retry_at:
+                return False
+        return self.observation_due() or self.forecast_due()
+
+    # (temp, condition, estimated) to show now, or None if nothing usable is
+    # cached. estimated is True when a forecast slot stands in for a missing
+    # or expired observation.
+    def current(self, now=None):
+        now = now or time()
+        with self.lock:
+            observation = self.observation
+            if observation is not None and monotonic() - observation['fetched'] < self.max_age:
+                return observation['temp'], observation['condition'], False
+            for slot in self.forecast:
+                if slot['time'] <= now < slot['time'] + FORECAST_STEP:
+                    return slot['temp'], slot['condition'], True
+        return None
+
+    # The next count forecast slots after now
+    def upcoming(self, count=2, now=None):
+        now = now or time()
+        with self.lock:
+            return [dict(slot) for slot in self.forecast if slot['time'] > now][:count]